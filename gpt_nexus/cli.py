@@ -1,17 +1,89 @@
 # gpt_nexus/cli.py
 import argparse
-from gpt_nexus.main import run
+import json
+import sys
+
+
+def run_command(args):
+    from gpt_nexus.main import run
+
+    run()
+
+
+def ingest_command(args):
+    from gpt_nexus.nexus_base.ingest import ingest_files
+    from gpt_nexus.nexus_base.knowledge_manager import KnowledgeManager
+
+    summary = ingest_files(
+        KnowledgeManager(),
+        args.store,
+        args.paths,
+        workers=args.workers,
+        embedding_backend=args.embedding_backend,
+    )
+    output = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+    if summary["totals"]["errors"]:
+        sys.exit(1)
+
+
+def benchmark_vectors_command(args):
+    from gpt_nexus.nexus_base.vector_benchmark import benchmark_vector_stores
+
+    summary = benchmark_vector_stores(
+        size=args.size, dimensions=args.dimensions, queries=args.queries, k=args.k
+    )
+    print(json.dumps(summary, indent=2))
+
 
 def main():
     parser = argparse.ArgumentParser(description="CLI for GPT Nexus App")
-    parser.add_argument('command', help="The command to run")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the Streamlit app")
+    run_parser.set_defaults(func=run_command)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="Load files, directories or archives into a knowledge store"
+    )
+    ingest_parser.add_argument("store", help="The knowledge store to load into")
+    ingest_parser.add_argument(
+        "paths", nargs="+", help="Files, directories or .zip/.tar archives"
+    )
+    ingest_parser.add_argument(
+        "--workers", type=int, default=4, help="Files to ingest concurrently"
+    )
+    ingest_parser.add_argument(
+        "--embedding-backend",
+        help="Embedding backend for the store if it does not exist yet",
+    )
+    ingest_parser.add_argument(
+        "--summary", help="Write the JSON summary to this file instead of stdout"
+    )
+    ingest_parser.set_defaults(func=ingest_command)
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark-vectors", help="Compare the vector store backends"
+    )
+    benchmark_parser.add_argument(
+        "--size", type=int, default=10000, help="Vectors to store"
+    )
+    benchmark_parser.add_argument(
+        "--dimensions", type=int, default=1536, help="Dimensions of the vectors"
+    )
+    benchmark_parser.add_argument(
+        "--queries", type=int, default=100, help="Queries to time"
+    )
+    benchmark_parser.add_argument("--k", type=int, default=5, help="Results per query")
+    benchmark_parser.set_defaults(func=benchmark_vectors_command)
 
     args = parser.parse_args()
+    args.func(args)
 
-    if args.command == 'run':
-        run()
-    else:
-        print(f"Unknown command: {args.command}")
 
 if __name__ == "__main__":
     main()
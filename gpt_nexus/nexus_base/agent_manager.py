@@ -2,6 +2,8 @@ import functools
 import importlib.util
 import os
 
+from gpt_nexus.nexus_base.single_flight import SingleFlight
+
 
 class BaseAgent:
     _supports_actions = False
@@ -133,6 +135,9 @@ class AgentManager:
         self.tracking_manager = tracking_manager
         if self.tracking_manager:
             self.track_agents(self.agents)
+        self.single_flight = SingleFlight()
+        for agent in self.agents:
+            self.coalesce_agent(agent)
 
     def get_agent(self, agent_name):
         for agent in self.agents:
@@ -179,6 +184,28 @@ class AgentManager:
                 ),
             )
 
+    def coalesce_agent(self, agent):
+        """
+        Wraps get_semantic_response so identical concurrent requests share a
+        single call to the agent engine.
+        """
+        get_semantic_response = agent.get_semantic_response
+
+        def coalesced_semantic_response(system, user):
+            key = (
+                agent.name,
+                getattr(agent, "model", None),
+                getattr(agent, "temperature", None),
+                system,
+                user,
+            )
+            return self.single_flight.do(key, get_semantic_response, system, user)
+
+        agent.get_semantic_response = coalesced_semantic_response
+
+    def get_single_flight_stats(self):
+        return self.single_flight.get_stats()
+
     def get_agent_names(self):
         return [agent.name for agent in self.agents]
 
@@ -0,0 +1,97 @@
+import threading
+
+from gpt_nexus.nexus_base.utils import count_tokens
+
+
+def similarity_from_distance(distance):
+    """
+    Converts a Chroma distance to a cosine similarity. Collections use the
+    default squared L2 space and embeddings are unit length, so
+    distance = 2 - 2 * cosine.
+    """
+    return 1.0 - distance / 2.0
+
+
+class ContextAssembler:
+    """
+    Packs retrieved chunks into the prompt context within a token budget per
+    kind of source. Chunks below a minimum similarity are dropped and the
+    rest are packed greedily, most similar first, counting tokens with the
+    tokenizer of the target model.
+    """
+
+    def __init__(
+        self,
+        budgets=None,
+        min_similarity=0.2,
+        default_budget=1000,
+        model="gpt-4o",
+    ):
+        self.budgets = budgets or {"knowledge": 1500, "memory": 500}
+        self.min_similarity = min_similarity
+        self.default_budget = default_budget
+        self.model = model
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def count_tokens(self, text, model=None):
+        return count_tokens(text, model or self.model)
+
+    def pack(self, kind, chunks, model=None):
+        """
+        Selects the chunks that fit the budget of a kind of source.
+
+        Args:
+            kind: The kind of source, "knowledge" or "memory", used to pick
+                the budget.
+            chunks: A list of (source, text, similarity). A similarity of None,
+                as for keyword matches, is never cut off and ranks after
+                scored chunks in its original order.
+            model: The model the prompt is for, used to count tokens.
+
+        Returns:
+            The selected (source, text) pairs, most similar first.
+        """
+        budget = self.budgets.get(kind, self.default_budget)
+        ranked = sorted(
+            (
+                chunk
+                for chunk in chunks
+                if chunk[2] is None or chunk[2] >= self.min_similarity
+            ),
+            key=lambda chunk: (chunk[2] is None, -(chunk[2] or 0.0)),
+        )
+        selected = []
+        tokens = {}
+        used = 0
+        for source, text, _ in ranked:
+            count = self.count_tokens(text, model)
+            if used + count > budget:
+                # a smaller chunk further down may still fit
+                continue
+            selected.append((source, text))
+            tokens[source] = tokens.get(source, 0) + count
+            used += count
+        self.record(chunks, selected, tokens)
+        return selected
+
+    def record(self, chunks, selected, tokens):
+        with self._lock:
+            for source in {chunk[0] for chunk in chunks} | set(tokens):
+                stats = self._stats.setdefault(
+                    source,
+                    {"retrievals": 0, "chunks": 0, "tokens": 0, "last_tokens": 0},
+                )
+                stats["retrievals"] += 1
+                stats["chunks"] += sum(1 for s, _ in selected if s == source)
+                stats["tokens"] += tokens.get(source, 0)
+                stats["last_tokens"] = tokens.get(source, 0)
+
+    def get_stats(self):
+        """
+        Returns:
+            A dict of source to its retrievals, packed chunks and tokens in
+            total and in the last retrieval.
+        """
+        with self._lock:
+            return {source: dict(stats) for source, stats in self._stats.items()}
@@ -0,0 +1,173 @@
+import hashlib
+import threading
+import time
+import unicodedata
+from array import array
+
+from peewee import (
+    BlobField,
+    CharField,
+    FloatField,
+    Model,
+    SqliteDatabase,
+)
+
+cache_db = SqliteDatabase("nexus_embedding_cache.db", pragmas={"journal_mode": "wal"})
+
+
+class EmbeddingCacheEntry(Model):
+    key = CharField(primary_key=True)
+    model = CharField(index=True)
+    embedding = BlobField()
+    last_access = FloatField(index=True)
+
+    class Meta:
+        database = cache_db
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFC", str(text))
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Disk-backed, content-addressed cache of embeddings keyed by
+    (model, sha256 of the normalized text) with LRU eviction.
+    """
+
+    SQLITE_MAX_VARIABLES = 900
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        cache_db.connect(reuse_if_open=True)
+        cache_db.create_tables([EmbeddingCacheEntry], safe=True)
+
+    def make_key(self, model, text):
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get_many(self, model, texts, touch=True):
+        """
+        Looks up embeddings for texts.
+
+        Args:
+            touch: Whether the lookup counts as a use, counting hits and
+                misses and refreshing the access time of found entries.
+
+        Returns:
+            A list the same length as texts with cached embeddings or None.
+        """
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for i in range(0, len(unique_keys), self.SQLITE_MAX_VARIABLES):
+            chunk = unique_keys[i : i + self.SQLITE_MAX_VARIABLES]
+            query = EmbeddingCacheEntry.select(
+                EmbeddingCacheEntry.key, EmbeddingCacheEntry.embedding
+            ).where(EmbeddingCacheEntry.key.in_(chunk))
+            for entry in query:
+                found[entry.key] = array("f", bytes(entry.embedding)).tolist()
+
+        if found and touch:
+            now = time.time()
+            hit_keys = list(found.keys())
+            with cache_db.atomic():
+                for i in range(0, len(hit_keys), self.SQLITE_MAX_VARIABLES):
+                    EmbeddingCacheEntry.update(last_access=now).where(
+                        EmbeddingCacheEntry.key.in_(
+                            hit_keys[i : i + self.SQLITE_MAX_VARIABLES]
+                        )
+                    ).execute()
+
+        results = [found.get(key) for key in keys]
+        if touch:
+            with self._lock:
+                hits = sum(1 for result in results if result is not None)
+                self.hits += hits
+                self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model, texts, embeddings):
+        now = time.time()
+        rows = {}
+        for text, embedding in zip(texts, embeddings):
+            if embedding is None:
+                continue
+            key = self.make_key(model, text)
+            rows[key] = {
+                "key": key,
+                "model": model,
+                "embedding": array("f", embedding).tobytes(),
+                "last_access": now,
+            }
+        if not rows:
+            return
+        rows = list(rows.values())
+        # 4 columns per row
+        step = self.SQLITE_MAX_VARIABLES // 4
+        with cache_db.atomic():
+            for i in range(0, len(rows), step):
+                EmbeddingCacheEntry.insert_many(
+                    rows[i : i + step]
+                ).on_conflict_replace().execute()
+        self.evict()
+
+    def evict(self):
+        count = EmbeddingCacheEntry.select().count()
+        if count <= self.max_entries:
+            return 0
+        # evict a little extra so every insert does not trigger a delete
+        excess = count - int(self.max_entries * 0.9)
+        oldest = (
+            EmbeddingCacheEntry.select(EmbeddingCacheEntry.key)
+            .order_by(EmbeddingCacheEntry.last_access.asc())
+            .limit(excess)
+        )
+        return (
+            EmbeddingCacheEntry.delete()
+            .where(EmbeddingCacheEntry.key.in_(oldest))
+            .execute()
+        )
+
+    def invalidate(self, model=None, keep_model=None):
+        """
+        Removes cached embeddings.
+
+        Args:
+            model: Only remove entries for this model (all entries if None).
+            keep_model: Remove every entry except those for this model.
+
+        Returns:
+            The number of entries removed.
+        """
+        query = EmbeddingCacheEntry.delete()
+        if model is not None:
+            query = query.where(EmbeddingCacheEntry.model == model)
+        elif keep_model is not None:
+            query = query.where(EmbeddingCacheEntry.model != keep_model)
+        return query.execute()
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": EmbeddingCacheEntry.select().count(),
+            "max_entries": self.max_entries,
+        }
+
+
+_shared_cache = None
+
+
+def get_embedding_cache():
+    """Returns the process wide cache shared by all embedding managers."""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = EmbeddingCache()
+    return _shared_cache
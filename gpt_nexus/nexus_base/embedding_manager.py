@@ -1,24 +1,379 @@
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+import weakref
+import zlib
+
+import openai
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from gpt_nexus.nexus_base.embedding_cache import get_embedding_cache
+from gpt_nexus.nexus_base.single_flight import SingleFlight
+from gpt_nexus.nexus_base.utils import count_tokens, run_sync
 
 load_dotenv
 
 
-class EmbeddingManager:
+def is_retryable(error):
+    """
+    Returns True for transient provider errors: rate limits, connection
+    errors, timeouts and server errors.
+    """
+    if isinstance(
+        error,
+        (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError),
+    ):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class EmbeddingBackend:
+    name = "base"
+    # local backends are cheaper to recompute than to look up
+    cacheable = True
+
     def __init__(self):
-        try:
-            self.client = OpenAI()
-            self.model = "text-embedding-3-small"
-        except Exception as e:
-            raise Exception(f"Error loading OpenAI client for Embedding: {e}")
+        self.model = None
+        # provider tokens billed for embeddings
+        self.tokens_used = 0
+
+    def embed(self, texts):
+        # Placeholder method to be implemented by subclasses
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+    async def aembed(self, texts):
+        # backends without a native async client run in a worker thread
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    name = "openai"
+
+    # OpenAI embedding endpoint limits, per request and per input
+    MAX_BATCH_ITEMS = 2048
+    MAX_BATCH_TOKENS = 300000
+    MAX_INPUT_TOKENS = 8191
+
+    def __init__(
+        self,
+        model="text-embedding-3-small",
+        max_concurrency=4,
+        max_retries=5,
+        backoff_base=0.5,
+        backoff_max=30.0,
+    ):
+        super().__init__()
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client = None
+        # one async client per event loop, as its connections belong to the loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._usage_lock = threading.Lock()
+        # caps requests in flight across every thread and event loop
+        self._limiter = threading.BoundedSemaphore(max_concurrency)
+
+    @property
+    def client(self):
+        # created on first use so local backends work without an API key
+        if self._client is None:
+            try:
+                # retries are handled by should_retry so the client does not retry
+                self._client = OpenAI(max_retries=0)
+            except Exception as e:
+                raise Exception(f"Error loading OpenAI client for Embedding: {e}")
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(max_retries=0)
+            self._async_clients[loop] = client
+        return client
+
+    def count_tokens(self, text):
+        return count_tokens(text, self.model)
+
+    def batch_texts(self, texts):
+        """
+        Packs texts into batches bounded by item count and token budget.
+
+        Args:
+            texts: A list of prepared strings.
+
+        Returns:
+            A list of lists of indices into texts, in input order.
+        """
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = min(self.count_tokens(text), self.MAX_INPUT_TOKENS)
+            if batch and (
+                len(batch) >= self.MAX_BATCH_ITEMS
+                or batch_tokens + tokens > self.MAX_BATCH_TOKENS
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed(self, texts):
+        batches = self.batch_texts(texts)
+        if len(batches) > 1:
+            # several requests are worth sending concurrently
+            return run_sync(self.aembed(texts))
+
+        embeddings = [None] * len(texts)
+        for batch in batches:
+            response = self.embed_batch([texts[i] for i in batch])
+            self.record_usage(response)
+            # the API returns items with an index relative to the request
+            for item in response.data:
+                embeddings[batch[item.index]] = item.embedding
+        return embeddings
+
+    def record_usage(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            with self._usage_lock:
+                self.tokens_used += usage.total_tokens
+
+    def is_retryable(self, error):
+        return is_retryable(error)
+
+    def should_retry(self, error, attempt):
+        return attempt < self.max_retries and self.is_retryable(error)
+
+    def get_backoff_delay(self, attempt):
+        # exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def embed_batch(self, texts):
+        """Sends one batch, retried with backoff on rate limit and server errors."""
+        attempt = 0
+        while True:
+            try:
+                with self._limiter:
+                    return self.client.embeddings.create(input=texts, model=self.model)
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+            time.sleep(self.get_backoff_delay(attempt))
+            attempt += 1
+
+    async def acquire_limiter(self):
+        # polled rather than waited on in a thread, so a cancelled request
+        # never takes a slot it cannot release
+        while not self._limiter.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+
+    async def aembed_batch(self, client, texts):
+        attempt = 0
+        while True:
+            await self.acquire_limiter()
+            try:
+                return await client.embeddings.create(input=texts, model=self.model)
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+            finally:
+                self._limiter.release()
+            await asyncio.sleep(self.get_backoff_delay(attempt))
+            attempt += 1
+
+    async def aembed(self, texts):
+        """
+        Embeds texts with batches sent concurrently, limited to
+        max_concurrency in-flight requests across the process and retried
+        with backoff on rate limit and server errors.
+        """
+        embeddings = [None] * len(texts)
+        batches = self.batch_texts(texts)
+        client = self.get_async_client()
+        responses = await asyncio.gather(
+            *[self.aembed_batch(client, [texts[i] for i in batch]) for batch in batches]
+        )
+        for batch, response in zip(batches, responses):
+            self.record_usage(response)
+            for item in response.data:
+                embeddings[batch[item.index]] = item.embedding
+        return embeddings
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic, CPU only embeddings built by hashing word unigrams,
+    word bigrams and character trigrams into a fixed number of signed
+    buckets. Needs no network or model download.
+    """
+
+    name = "hashing"
+    cacheable = False
+    TOKEN_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, dimensions=512):
+        super().__init__()
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+
+    def features(self, text):
+        words = self.TOKEN_PATTERN.findall(text.lower())
+        features = list(words)
+        features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f"<{word}>"
+            features += [padded[i : i + 3] for i in range(len(padded) - 2)]
+        return features
+
+    def embed_text(self, text):
+        vector = [0.0] * self.dimensions
+        for feature in self.features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vector[h % self.dimensions] += sign
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm > 0:
+            vector = [v / norm for v in vector]
+        return vector
+
+    def embed(self, texts):
+        return [self.embed_text(text) for text in texts]
+
+
+EMBEDDING_BACKENDS = {
+    OpenAIEmbeddingBackend.name: OpenAIEmbeddingBackend,
+    HashingEmbeddingBackend.name: HashingEmbeddingBackend,
+}
+
+
+def get_embedding_backend_names():
+    return list(EMBEDDING_BACKENDS.keys())
+
+
+# shared by every embedding manager so identical concurrent queries coalesce
+embedding_single_flight = SingleFlight()
+
+
+class EmbeddingManager:
+    def __init__(self, backend="openai", cache=None, single_flight=None):
+        if isinstance(backend, str):
+            if backend not in EMBEDDING_BACKENDS:
+                raise ValueError(f"Unknown embedding backend '{backend}'.")
+            backend = EMBEDDING_BACKENDS[backend]()
+        self.backend = backend
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.single_flight = single_flight or embedding_single_flight
+
+    @property
+    def model(self):
+        return self.backend.model
+
+    @property
+    def client(self):
+        return self.backend.client
+
+    def set_model(self, model):
+        """Switches embedding model and drops vectors cached for other models."""
+        if model != self.backend.model:
+            self.backend.model = model
+            self.cache.invalidate(keep_model=model)
+
+    def prepare_text(self, text):
+        text = str(text)
+        return text.replace("\n", " ")
 
     def get_embedding(self, text):
         if text is None:
             return None
-        text = str(text)
-        text = text.replace("\n", " ")
-        return (
-            self.client.embeddings.create(input=[text], model=self.model)
-            .data[0]
-            .embedding
-        )
+        key = (self.model, self.prepare_text(text))
+        return self.single_flight.do(key, lambda: self.get_embeddings([text])[0])
+
+    def lookup_embeddings(self, texts, touch=True):
+        """
+        Resolves texts from the cache.
+
+        Args:
+            texts: A list of texts, None entries are skipped.
+            touch: Whether the lookup counts as a use of the cache, see
+                EmbeddingCache.get_many.
+
+        Returns:
+            A tuple of the embeddings found so far (None where missing) and
+            the distinct prepared texts that still need to be embedded.
+        """
+        embeddings = [None] * len(texts)
+        indices = [i for i, text in enumerate(texts) if text is not None]
+        prepared = [self.prepare_text(texts[i]) for i in indices]
+        if not self.backend.cacheable:
+            return embeddings, list(dict.fromkeys(prepared))
+
+        cached = self.cache.get_many(self.model, prepared, touch)
+        missing = []
+        for i, text, embedding in zip(indices, prepared, cached):
+            if embedding is None:
+                missing.append(text)
+            else:
+                embeddings[i] = embedding
+        # embed each distinct missing text only once
+        return embeddings, list(dict.fromkeys(missing))
+
+    def merge_embeddings(self, texts, embeddings, missing, computed):
+        if self.backend.cacheable:
+            self.cache.put_many(self.model, missing, computed)
+        computed = dict(zip(missing, computed))
+        for i, text in enumerate(texts):
+            if text is not None and embeddings[i] is None:
+                embeddings[i] = computed[self.prepare_text(text)]
+        return embeddings
+
+    def get_embeddings(self, texts):
+        """
+        Embeds a list of texts using as few requests as possible.
+
+        Args:
+            texts: A list of strings (None entries are returned as None).
+
+        Returns:
+            A list of embeddings in the same order as texts.
+        """
+        embeddings, missing = self.lookup_embeddings(texts)
+        computed = self.embed_texts(missing)
+        return self.merge_embeddings(texts, embeddings, missing, computed)
+
+    async def aget_embeddings(self, texts):
+        """Async version of get_embeddings with concurrent provider requests."""
+        embeddings, missing = self.lookup_embeddings(texts)
+        computed = await self.backend.aembed(missing) if missing else []
+        return self.merge_embeddings(texts, embeddings, missing, computed)
+
+    def embed_texts(self, texts):
+        """Embeds prepared texts with the backend, bypassing the cache."""
+        if not texts:
+            return []
+        return self.backend.embed(texts)
+
+    @property
+    def tokens_used(self):
+        return self.backend.tokens_used
+
+    def get_cache_stats(self):
+        return self.cache.get_stats()
+
+    def get_single_flight_stats(self):
+        return self.single_flight.get_stats()
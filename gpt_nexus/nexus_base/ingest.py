@@ -0,0 +1,144 @@
+import io
+import os
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from gpt_nexus.nexus_base.nexus_models import KnowledgeStore
+
+TEXT_EXTENSIONS = {".txt", ".md", ".html", ".csv", ".py", ".json"}
+FILE_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2")
+
+
+class LocalFile(io.BytesIO):
+    """An in-memory file that looks like a Streamlit UploadedFile."""
+
+    def __init__(self, data, name, type):
+        super().__init__(data)
+        self.name = name
+        self.type = type
+
+
+def get_file_type(name):
+    extension = os.path.splitext(name)[1].lower()
+    if extension in TEXT_EXTENSIONS:
+        return "text/plain"
+    return FILE_TYPES.get(extension)
+
+
+def iter_archive_files(path):
+    """Yields (name, reader) for every supported file inside an archive."""
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and get_file_type(info.filename):
+                    yield f"{path}/{info.filename}", (
+                        lambda info=info: archive.read(info)
+                    )
+    else:
+        with tarfile.open(path) as archive:
+            for member in archive.getmembers():
+                if member.isfile() and get_file_type(member.name):
+                    yield f"{path}/{member.name}", (
+                        lambda member=member: archive.extractfile(member).read()
+                    )
+
+
+def iter_ingest_files(paths):
+    """
+    Walks files, directories and archives and yields (name, reader) pairs
+    for every file type the knowledge manager can read.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                yield from iter_ingest_files(
+                    sorted(os.path.join(root, file) for file in files)
+                )
+        elif path.lower().endswith(ARCHIVE_EXTENSIONS):
+            yield from iter_archive_files(path)
+        elif get_file_type(path):
+            yield path, (lambda path=path: read_path(path))
+
+
+def read_path(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def ingest_file(knowledge_manager, knowledge_store, name, data):
+    start = time.time()
+    result = {"file": name}
+    try:
+        uploaded_file = LocalFile(data, name, get_file_type(name))
+        result.update(knowledge_manager.load_document(knowledge_store, uploaded_file))
+    except Exception as e:
+        result["error"] = str(e)
+    result["seconds"] = round(time.time() - start, 3)
+    return result
+
+
+def ingest_files(
+    knowledge_manager, store_name, paths, workers=4, embedding_backend=None
+):
+    """
+    Ingests every supported file under paths into a knowledge store using a
+    pool of worker threads that share one knowledge manager, so embeddings
+    go through the same batching, cache and rate limiting.
+
+    Args:
+        knowledge_manager: The KnowledgeManager to ingest with.
+        store_name: The knowledge store to load into, created if missing.
+        paths: Files, directories or archives to ingest.
+        workers: The number of files ingested concurrently.
+        embedding_backend: The embedding backend of the store if it is created.
+
+    Returns:
+        A summary dict with one entry per file and totals.
+    """
+    created = knowledge_manager.add_knowledge_store(store_name)
+    knowledge_store = KnowledgeStore.get(KnowledgeStore.name == store_name)
+    if created and embedding_backend:
+        knowledge_store.embedding_backend = embedding_backend
+        knowledge_store.save()
+    embedding_manager = knowledge_manager.get_embedding_manager(knowledge_store)
+    tokens_before = embedding_manager.tokens_used
+    start = time.time()
+
+    files = []
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # files are read on this thread, as archive readers are not thread
+        # safe, and only a few ahead of the workers to bound memory use
+        for name, reader in iter_ingest_files(paths):
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                files.extend(future.result() for future in done)
+            pending.add(
+                executor.submit(
+                    ingest_file, knowledge_manager, knowledge_store, name, reader()
+                )
+            )
+        files.extend(future.result() for future in pending)
+    files.sort(key=lambda file: file["file"])
+
+    return {
+        "store": store_name,
+        "files": files,
+        "totals": {
+            "files": len(files),
+            "skipped": sum(1 for file in files if file.get("skipped")),
+            "errors": sum(1 for file in files if "error" in file),
+            "chunks": sum(file.get("chunks", 0) for file in files),
+            "added": sum(file.get("added", 0) for file in files),
+            "near_duplicates": sum(file.get("near_duplicates", 0) for file in files),
+            "embeddings_saved": sum(file.get("embeddings_saved", 0) for file in files),
+            "seconds": round(time.time() - start, 3),
+            "tokens": embedding_manager.tokens_used - tokens_before,
+        },
+    }
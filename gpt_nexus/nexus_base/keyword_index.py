@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+
+
+class KeywordIndex:
+    """
+    Full text index of knowledge store chunks backed by SQLite FTS5 and
+    ranked with BM25. One table holds every store, keyed by store name.
+    """
+
+    SQLITE_MAX_VARIABLES = 900
+
+    def __init__(self, path="nexus_knowledge_fts.db"):
+        self.path = path
+        self._local = threading.local()
+        # keeps the existence check and insert of concurrent adds together
+        self._write_lock = threading.Lock()
+        with self.connection as connection:
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+                "store UNINDEXED, chunk_id UNINDEXED, content, "
+                "tokenize='porter unicode61')"
+            )
+
+    @property
+    def connection(self):
+        # sqlite connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = connection
+        return connection
+
+    def get_existing_ids(self, store, ids):
+        existing = set()
+        for i in range(0, len(ids), self.SQLITE_MAX_VARIABLES):
+            chunk = ids[i : i + self.SQLITE_MAX_VARIABLES]
+            rows = self.connection.execute(
+                f"SELECT chunk_id FROM chunks WHERE store = ? AND chunk_id IN "
+                f"({','.join('?' * len(chunk))})",
+                [store, *chunk],
+            )
+            existing.update(row[0] for row in rows)
+        return existing
+
+    def add(self, store, ids, documents):
+        """Indexes chunks that are not in the index yet."""
+        with self._write_lock:
+            existing = self.get_existing_ids(store, list(ids))
+            rows = dict(
+                (id, (store, id, document))
+                for id, document in zip(ids, documents)
+                if id not in existing
+            )
+            with self.connection as connection:
+                connection.executemany(
+                    "INSERT INTO chunks (store, chunk_id, content) VALUES (?, ?, ?)",
+                    rows.values(),
+                )
+        return len(rows)
+
+    def delete(self, store, ids):
+        ids = list(ids)
+        with self.connection as connection:
+            for i in range(0, len(ids), self.SQLITE_MAX_VARIABLES):
+                chunk = ids[i : i + self.SQLITE_MAX_VARIABLES]
+                connection.execute(
+                    f"DELETE FROM chunks WHERE store = ? AND chunk_id IN "
+                    f"({','.join('?' * len(chunk))})",
+                    [store, *chunk],
+                )
+
+    def delete_store(self, store):
+        with self.connection as connection:
+            connection.execute("DELETE FROM chunks WHERE store = ?", [store])
+
+    def count(self, store):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM chunks WHERE store = ?", [store]
+        ).fetchone()[0]
+
+    def build_match_query(self, query):
+        # quote every term so punctuation in identifiers is not parsed as
+        # FTS5 syntax, a quoted term with punctuation becomes a phrase
+        terms = [term.replace('"', '""') for term in query.split()]
+        return " OR ".join(f'"{term}"' for term in terms if term.strip('"'))
+
+    def search(self, store, query, n_results=5):
+        """
+        Returns:
+            A list of (chunk_id, document, score) ordered best first.
+        """
+        match = self.build_match_query(query)
+        if not match:
+            return []
+        rows = self.connection.execute(
+            "SELECT chunk_id, content, bm25(chunks) AS score FROM chunks "
+            "WHERE chunks MATCH ? AND store = ? ORDER BY score LIMIT ?",
+            [match, store, n_results],
+        )
+        # bm25() is lower for better matches
+        return [(id, content, -score) for id, content, score in rows]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several rankings of ids into one.
+
+    Args:
+        rankings: A list of lists of ids, each ordered best first.
+        k: Dampens the weight of the top ranks.
+
+    Returns:
+        A list of ids ordered by fused score, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -1,6 +1,16 @@
+import asyncio
+import hashlib
 import json
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
-import chromadb
 import pandas as pd
 from dotenv import load_dotenv
 from langchain_text_splitters import (
@@ -8,30 +18,81 @@ from langchain_text_splitters import (
     RecursiveCharacterTextSplitter,
 )
 
+from gpt_nexus.nexus_base.context_assembler import similarity_from_distance
 from gpt_nexus.nexus_base.embedding_manager import EmbeddingManager
-from gpt_nexus.nexus_base.nexus_models import KnowledgeStore, db
+from gpt_nexus.nexus_base.keyword_index import KeywordIndex, reciprocal_rank_fusion
+from gpt_nexus.nexus_base.near_duplicates import MinHashIndex
+from gpt_nexus.nexus_base.nexus_models import (
+    Document,
+    IngestionRecord,
+    KnowledgeStore,
+    db,
+)
+from gpt_nexus.nexus_base.rag_cache import rag_cache
 from gpt_nexus.nexus_base.utils import (
+    batched,
     convert_keys_to_lowercase,
     extract_code,
     id_hash,
+    map_with_context,
+    run_sync,
 )
+from gpt_nexus.nexus_base.vector_store_pool import vector_store_pool
 
 load_dotenv()
 
 
+def extract_pdf_pages(path, start, end):
+    """Extracts the text of pages [start, end) of a PDF, used by worker processes."""
+    import pdfplumber
+
+    with pdfplumber.open(path) as pdf:
+        texts = []
+        for page in pdf.pages[start:end]:
+            texts.append(page.extract_text())
+            page.flush_cache()
+        return texts
+
+
 class KnowledgeManager:
-    def __init__(self):
-        self.embedding_manager = EmbeddingManager()
+    # chunks embedded and added to the collection per batch
+    INGEST_BATCH_SIZE = 256
+    # batches embedded concurrently while ingesting
+    INGEST_CONCURRENT_BATCHES = 4
+    # how many chunks worth of text to buffer before splitting
+    SPLIT_BUFFER_CHUNKS = 16
+    # bytes of a text file read per segment
+    TEXT_BLOCK_SIZE = 65536
+    # PDFs with fewer pages are extracted serially
+    PDF_PARALLEL_MIN_PAGES = 32
+    # query modes supported by query_documents
+    QUERY_MODES = ["vector", "keyword", "hybrid"]
+    # candidates fetched from each retriever per result in hybrid mode
+    HYBRID_CANDIDATES = 3
+    # largest gap in characters between chunks that are stitched together
+    STITCH_MAX_GAP = 2
+    # clusters summarized concurrently when compressing
+    COMPRESS_WORKERS = 4
+
+    def __init__(self, pdf_workers=None):
+        self.pdf_workers = pdf_workers or os.cpu_count() or 1
+        self._pdf_executor = None
+        self._pdf_executor_lock = threading.Lock()
+        self.embedding_managers = {}
+        self.embedding_manager = self.get_embedding_manager()
         self.CHROMA_DB = "nexus_knowledge_chroma_db"
+        self.keyword_index = KeywordIndex()
+        self.keyword_indexed = set()
+        self.near_duplicate_indexes = {}
+        self._near_duplicate_lock = threading.Lock()
         self.initialize_stores()
 
     def initialize_stores(self):
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collections = chroma_client.list_collections()
-        for collection in collections:
-            self.add_knowledge_store(collection.name)
+        collections = vector_store_pool.list_collections(self.CHROMA_DB)
+        for name, vector_backend in collections.items():
+            self.add_knowledge_store(name, vector_backend)
 
-    def add_knowledge_store(self, store_name):
+    def add_knowledge_store(self, store_name, vector_backend="chroma"):
         if store_name is None or store_name == "None":
             return False
         with db.atomic():
@@ -39,45 +100,420 @@ class KnowledgeManager:
                 KnowledgeStore.select().where(KnowledgeStore.name == store_name).count()
                 == 0
             ):
-                KnowledgeStore.create(name=store_name)
+                KnowledgeStore.create(name=store_name, vector_backend=vector_backend)
                 return True
         return False
 
-    def get_document_embedding(self, text):
-        return self.embedding_manager.get_embedding(text)
+    def get_knowledge_store(self, knowledge_store):
+        if isinstance(knowledge_store, KnowledgeStore):
+            return knowledge_store
+        return (
+            KnowledgeStore.select()
+            .where(KnowledgeStore.name == knowledge_store)
+            .first()
+        )
+
+    def check_embedding_backend(self, knowledge_store):
+        """
+        Raises a ValueError if the embedding backend of a store that already
+        holds embeddings was changed, as embeddings of different backends can
+        not be compared and may not even have the same dimensions.
+        """
+        saved = KnowledgeStore.get_or_none(KnowledgeStore.id == knowledge_store.id)
+        if (
+            saved is not None
+            and saved.embedding_backend != knowledge_store.embedding_backend
+            and self.count_documents(knowledge_store.name) > 0
+        ):
+            raise ValueError(
+                f"Knowledge store '{knowledge_store.name}' already has embeddings, "
+                "its embedding backend can only be changed while it is empty."
+            )
+
+    def check_vector_backend(self, knowledge_store):
+        """
+        Raises a ValueError if the vector store backend of a store that
+        already holds chunks was changed, as chunks are not moved between
+        backends and the store would read empty.
+        """
+        saved = KnowledgeStore.get_or_none(KnowledgeStore.id == knowledge_store.id)
+        if (
+            saved is not None
+            and saved.vector_backend != knowledge_store.vector_backend
+            and self.count_documents(knowledge_store.name) > 0
+        ):
+            raise ValueError(
+                f"Knowledge store '{knowledge_store.name}' already has chunks, "
+                "its vector store can only be changed while it is empty."
+            )
+
+    def get_vector_config(self, knowledge_store):
+        """
+        Returns:
+            A tuple of the vector store backend of a store and its options.
+        """
+        store = self.get_knowledge_store(knowledge_store)
+        if store is None:
+            return "chroma", {}
+        if store.vector_backend != "numpy":
+            return store.vector_backend, {}
+        return store.vector_backend, {
+            "precision": store.vector_precision,
+            "rescore": store.vector_rescore,
+        }
+
+    def read_store(self, knowledge_store):
+        """Returns a context manager yielding the store's vector store to read."""
+        backend, options = self.get_vector_config(knowledge_store)
+        return vector_store_pool.read(
+            self.CHROMA_DB,
+            getattr(knowledge_store, "name", knowledge_store),
+            backend,
+            **options,
+        )
+
+    def write_store(self, knowledge_store):
+        """Returns a context manager yielding the store's vector store to write."""
+        backend, options = self.get_vector_config(knowledge_store)
+        return vector_store_pool.write(
+            self.CHROMA_DB,
+            getattr(knowledge_store, "name", knowledge_store),
+            backend,
+            **options,
+        )
+
+    def get_embedding_manager(self, knowledge_store=None):
+        backend = "openai"
+        if knowledge_store is not None:
+            store = self.get_knowledge_store(knowledge_store)
+            if store is not None:
+                backend = store.embedding_backend
+        if backend not in self.embedding_managers:
+            self.embedding_managers[backend] = EmbeddingManager(backend)
+        return self.embedding_managers[backend]
+
+    def get_document_embedding(self, text, knowledge_store=None):
+        return self.get_embedding_manager(knowledge_store).get_embedding(text)
+
+    def get_document_embeddings(self, texts, knowledge_store=None):
+        return self.get_embedding_manager(knowledge_store).get_embeddings(texts)
+
+    def ensure_keyword_index(self, knowledge_store):
+        """Builds the keyword index of a store that was loaded before it existed."""
+        if knowledge_store in self.keyword_indexed:
+            return
+        if self.keyword_index.count(knowledge_store) == 0:
+            total = self.count_documents(knowledge_store)
+            for offset in range(0, total, self.INGEST_BATCH_SIZE):
+                documents = self.get_documents(
+                    knowledge_store,
+                    include=["documents"],
+                    offset=offset,
+                    limit=self.INGEST_BATCH_SIZE,
+                )
+                self.keyword_index.add(
+                    knowledge_store, documents["ids"], documents["documents"]
+                )
+        self.keyword_indexed.add(knowledge_store)
+
+    def get_near_duplicate_index(self, knowledge_store):
+        """
+        Returns the near-duplicate index of a store, built from its chunks on
+        first use, or None if the store does not skip near-duplicates.
+        """
+        threshold = knowledge_store.near_duplicate_threshold or 0
+        if threshold <= 0:
+            return None
+        with self._near_duplicate_lock:
+            index = self.near_duplicate_indexes.get(knowledge_store.name)
+            if index is not None and index.threshold == threshold:
+                return index
+            index = MinHashIndex(threshold)
+            total = self.count_documents(knowledge_store.name)
+            for offset in range(0, total, self.INGEST_BATCH_SIZE):
+                documents = self.get_documents(
+                    knowledge_store.name,
+                    include=["documents"],
+                    offset=offset,
+                    limit=self.INGEST_BATCH_SIZE,
+                )
+                index.add_many(documents["ids"], documents["documents"])
+            self.near_duplicate_indexes[knowledge_store.name] = index
+            return index
+
+    def filter_near_duplicates(self, index, chunks):
+        """
+        Splits new chunks into the ones to embed and the near-duplicates of
+        chunks that are already indexed, including earlier ones of the batch.
+
+        Returns:
+            A tuple of (dict of id to text to embed, dict of the id of each
+            near-duplicate to the id of the chunk it duplicates).
+        """
+        unique = {}
+        duplicates = {}
+        for id, text in chunks.items():
+            duplicate = index.add_if_unique(id, text)
+            if duplicate is None:
+                unique[id] = text
+            else:
+                duplicates[id] = duplicate
+        return unique, duplicates
+
+    def query_by_embedding(self, knowledge_store, embedding, n_results=5, where=None):
+        """
+        Returns:
+            A list of (id, document, distance, metadata) for the nearest chunks
+            whose metadata matches the optional Chroma where filter.
+        """
+        with self.read_store(knowledge_store) as collection:
+            docs = collection.query(
+                query_embeddings=[embedding],
+                n_results=n_results,
+                where=where or None,
+                include=["documents", "distances", "metadatas"],
+            )
+        return list(
+            zip(
+                docs["ids"][0],
+                docs["documents"][0],
+                docs["distances"][0],
+                docs["metadatas"][0],
+            )
+        )
+
+    def query_vector(self, knowledge_store, input_text, n_results, where=None):
+        embedding = self.get_document_embedding(input_text, knowledge_store)
+        return [
+            (id, document, similarity_from_distance(distance), metadata)
+            for id, document, distance, metadata in self.query_by_embedding(
+                knowledge_store, embedding, n_results, where
+            )
+        ]
+
+    def query_keyword(self, knowledge_store, input_text, n_results, where=None):
+        self.ensure_keyword_index(knowledge_store)
+        # the keyword index has no metadata, so filter a larger candidate set
+        candidates = n_results * self.HYBRID_CANDIDATES if where else n_results
+        results = self.keyword_index.search(knowledge_store, input_text, candidates)
+        if not results:
+            return []
+        with self.read_store(knowledge_store) as collection:
+            found = collection.get(
+                ids=[id for id, _, _ in results],
+                where=where or None,
+                include=["metadatas"],
+            )
+        metadatas = dict(zip(found["ids"], found["metadatas"]))
+        # BM25 scores are not similarities
+        return [
+            (id, document, None, metadatas[id])
+            for id, document, _ in results
+            if id in metadatas
+        ][:n_results]
+
+    def search_documents(
+        self, knowledge_store, input_text, n_results=5, mode=None, where=None
+    ):
+        """
+        Searches a knowledge store for the documents most relevant to the input.
 
-    def query_documents(self, knowledge_store, input_text, n_results=5):
+        Args:
+            knowledge_store: The name of the knowledge store.
+            input_text: The query text.
+            n_results: The number of documents to return.
+            mode: "vector" for embedding similarity, "keyword" for BM25 over
+                the keyword index, which needs no embedding call, or "hybrid"
+                to fuse both rankings with reciprocal rank fusion. None uses
+                the query mode of the store.
+            where: An optional Chroma metadata filter, such as
+                {"document": "notes.pdf"} or {"ingested_at": {"$gte": timestamp}}.
+
+        Returns:
+            A list of (id, document, similarity, metadata), best first. The
+            similarity is None for documents only matched by keyword. Results
+            are cached until the store changes.
+        """
         if knowledge_store is None or input_text is None:
             return None
+        if mode is None:
+            store = self.get_knowledge_store(knowledge_store)
+            mode = store.query_mode if store is not None else "vector"
+        if mode not in self.QUERY_MODES:
+            raise ValueError(f"Unknown query mode: {mode}")
 
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collection = chroma_client.get_or_create_collection(name=knowledge_store)
-        embedding = self.get_document_embedding(input_text)
-        docs = collection.query(
-            query_embeddings=[embedding], n_results=n_results, include=["documents"]
+        return rag_cache.get_or_query(
+            "knowledge",
+            knowledge_store,
+            input_text,
+            n_results,
+            lambda: self.retrieve_documents(
+                knowledge_store, input_text, n_results, mode, where
+            ),
+            mode,
+            json.dumps(where, sort_keys=True) if where else None,
         )
-        return docs["documents"]
 
-    def apply_knowledge_RAG(self, knowledge_store, input_text, n_results=5):
+    def retrieve_documents(
+        self, knowledge_store, input_text, n_results, mode, where=None
+    ):
+        if mode == "vector":
+            return self.query_vector(knowledge_store, input_text, n_results, where)
+        elif mode == "keyword":
+            return self.query_keyword(knowledge_store, input_text, n_results, where)
+
+        candidates = n_results * self.HYBRID_CANDIDATES
+        rankings = [
+            self.query_vector(knowledge_store, input_text, candidates, where),
+            self.query_keyword(knowledge_store, input_text, candidates, where),
+        ]
+        # keyword results come last so vector similarities are kept
+        results = {id: result for ranking in rankings[::-1] for id, *result in ranking}
+        fused = reciprocal_rank_fusion(
+            [[id for id, *_ in ranking] for ranking in rankings]
+        )
+        return [(id, *results[id]) for id in fused[:n_results]]
+
+    def query_documents(
+        self, knowledge_store, input_text, n_results=5, mode=None, where=None
+    ):
+        """
+        Queries a knowledge store, see search_documents.
+
+        Returns:
+            A list holding the list of matching documents.
+        """
+        results = self.search_documents(
+            knowledge_store, input_text, n_results, mode, where
+        )
+        if results is None:
+            return None
+        return [[document for _, document, *_ in results]]
+
+    def apply_knowledge_RAG(
+        self,
+        knowledge_store,
+        input_text,
+        n_results=5,
+        mode=None,
+        assembler=None,
+        model=None,
+    ):
+        """
+        Builds the knowledge context for a prompt. With a ContextAssembler
+        the documents are cut off by similarity and packed into its token budget.
+        """
         if knowledge_store is None or input_text is None:
             return None
 
-        docs = self.query_documents(knowledge_store, input_text, n_results)
+        results = self.search_documents(knowledge_store, input_text, n_results, mode)
+        chunks = self.stitch_chunks(
+            [
+                (knowledge_store, document, similarity, metadata)
+                for _, document, similarity, metadata in results
+            ]
+        )
+        if assembler is not None:
+            chunks = assembler.pack("knowledge", chunks, model)
+        docs = [chunk[1] for chunk in chunks]
 
         prompt = ""
-        if docs and len(docs) > 0 and len(docs[0]) > 0:
+        if docs:
             prompt += "\nUse the following documents to help answer the question:\n"
             for i, doc in enumerate(docs):
                 prompt += f"Document {i+1}:\n{doc}\n"
         return prompt
 
-    def get_documents(self, knowledge_store, include=["documents", "embeddings"]):
+    def stitch_chunks(self, chunks):
+        """
+        Merges retrieved chunks of the same document that overlap or are
+        adjacent into one contiguous passage, so overlapping text is only
+        sent once.
+
+        Args:
+            chunks: A list of (source, text, similarity, metadata), best
+                first. Chunks without position metadata are kept as they are.
+
+        Returns:
+            A list of (source, text, similarity), ordered by the best chunk
+            of each passage.
+        """
+        passages = []
+        documents = {}
+        for rank, (source, text, similarity, metadata) in enumerate(chunks):
+            if not metadata or "start" not in metadata:
+                passages.append((rank, source, text, similarity))
+                continue
+            documents.setdefault((source, metadata["document_id"]), []).append(
+                (metadata["start"], metadata["end"], rank, text, similarity)
+            )
+
+        for (source, _), spans in documents.items():
+            spans.sort()
+            _, end, rank, text, similarity = spans[0]
+            for span in spans[1:]:
+                merged = self.merge_span(text, end, span[0], span[1], span[3])
+                if merged is None:
+                    passages.append((rank, source, text, similarity))
+                    _, end, rank, text, similarity = span
+                    continue
+                text = merged
+                end = max(end, span[1])
+                rank = min(rank, span[2])
+                if span[4] is not None and (similarity is None or span[4] > similarity):
+                    similarity = span[4]
+            passages.append((rank, source, text, similarity))
+
+        passages.sort(key=lambda passage: passage[0])
+        return [(source, text, similarity) for _, source, text, similarity in passages]
+
+    def merge_span(self, text, end, next_start, next_end, next_text):
+        """
+        Returns:
+            The text of a passage extended by the next chunk of the same
+            document, or None if the chunk does not touch the passage.
+        """
+        overlap = end - next_start
+        if next_end <= end and next_text in text:
+            return text
+        if 0 < overlap < len(next_text):
+            # offsets are estimates, only trust them if the text agrees
+            if text.endswith(next_text[:overlap]):
+                return text + next_text[overlap:]
+            return None
+        if -self.STITCH_MAX_GAP <= overlap <= 0:
+            # the splitter dropped the whitespace between the chunks
+            return text + ("\n" if overlap else "") + next_text
+        return None
+
+    def count_documents(self, knowledge_store):
+        if knowledge_store is None:
+            return 0
+
+        with self.read_store(knowledge_store) as collection:
+            return collection.count()
+
+    def get_documents(
+        self,
+        knowledge_store,
+        include=["documents", "embeddings"],
+        offset=None,
+        limit=None,
+    ):
+        """
+        Gets the chunks of a knowledge store, or one page of them.
+
+        Args:
+            knowledge_store: The name of the knowledge store.
+            include: The fields to return besides ids, an empty list returns ids only.
+            offset: The number of chunks to skip.
+            limit: The maximum number of chunks to return.
+        """
         if knowledge_store is None:
             return None
 
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collection = chroma_client.get_or_create_collection(name=knowledge_store)
-        documents = collection.get(include=include)
+        with self.read_store(knowledge_store) as collection:
+            documents = collection.get(include=include, offset=offset, limit=limit)
         return documents
 
     def get_splitter(self, knowledge_store):
@@ -97,85 +533,643 @@ class KnowledgeManager:
                 is_separator_regex=False,
             )
 
+    def iter_file_text(self, uploaded_file):
+        """
+        Yields the text of an uploaded file one page, paragraph or block of
+        lines at a time so large files are never held as a single string.
+        """
+        if uploaded_file is None:
+            return
+        # Check the file type
+        if uploaded_file.type == "text/plain":
+            while True:
+                lines = uploaded_file.readlines(self.TEXT_BLOCK_SIZE)
+                if not lines:
+                    break
+                text = b"".join(lines).decode("utf-8")
+                # segments are joined with a newline again when split
+                yield text[:-1] if text.endswith("\n") else text
+        elif uploaded_file.type == "application/pdf":
+            yield from self.iter_pdf_text(uploaded_file)
+        elif (
+            uploaded_file.type
+            == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        ):
+            try:
+                import docx
+            except ImportError:
+                raise Exception("Please install python-docx to read DOCX files.")
+
+            doc = docx.Document(uploaded_file)
+            for para in doc.paragraphs:
+                yield para.text
+
+    def get_pdf_executor(self):
+        # one pool for every file, so concurrent ingests share pdf_workers
+        with self._pdf_executor_lock:
+            if self._pdf_executor is None:
+                # forking a multithreaded process can copy locks held by
+                # other threads into the workers
+                self._pdf_executor = ProcessPoolExecutor(
+                    max_workers=self.pdf_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pdf_executor
+
+    def iter_pdf_text(self, uploaded_file):
+        """
+        Yields the text of each PDF page in order. Large PDFs are split into
+        page ranges that are extracted in parallel by a process pool shared
+        by every file; small ones, or a pool of one worker, use the serial
+        path.
+        """
+        try:
+            import pdfplumber
+        except ImportError:
+            raise Exception("Please install pdfplumber to read PDF files.")
+
+        with pdfplumber.open(uploaded_file) as pdf:
+            page_count = len(pdf.pages)
+            if self.pdf_workers <= 1 or page_count < self.PDF_PARALLEL_MIN_PAGES:
+                for page in pdf.pages:
+                    text = page.extract_text()
+                    # release the parsed page objects as we go
+                    page.flush_cache()
+                    yield text
+                return
+
+        # workers open their own copy of the file by path
+        uploaded_file.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_file:
+            shutil.copyfileobj(uploaded_file, pdf_file)
+        try:
+            shard_size = math.ceil(page_count / (self.pdf_workers * 2))
+            ranges = [
+                (start, min(start + shard_size, page_count))
+                for start in range(0, page_count, shard_size)
+            ]
+            shards = self.get_pdf_executor().map(
+                extract_pdf_pages,
+                [pdf_file.name] * len(ranges),
+                [start for start, _ in ranges],
+                [end for _, end in ranges],
+            )
+            # map returns shards in submission order
+            for pages in shards:
+                yield from pages
+        finally:
+            os.remove(pdf_file.name)
+
     def read_file(self, uploaded_file):
-        document = None
-        if uploaded_file is not None:
-            # Check the file type
-            if uploaded_file.type == "text/plain":
-                document = uploaded_file.read().decode("utf-8")
-            elif uploaded_file.type == "application/pdf":
-                try:
-                    import pdfplumber
-
-                    with pdfplumber.open(uploaded_file) as pdf:
-                        pages = [page.extract_text() for page in pdf.pages]
-                    document = "\n".join(pages)  # Join the text of all pages
-                except ImportError:
-                    raise Exception("Please install pdfplumber to read PDF files.")
-            elif (
-                uploaded_file.type
-                == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        if uploaded_file is None:
+            return None
+        segments = list(self.iter_file_text(uploaded_file))
+        if not segments:
+            return None
+        return "\n".join(segments)
+
+    def iter_chunks(self, segments, splitter, chunk_size):
+        """Splits a stream of text segments incrementally, see iter_chunk_spans."""
+        for chunk, _, _ in self.iter_chunk_spans(segments, splitter, chunk_size):
+            yield chunk
+
+    def iter_chunk_spans(self, segments, splitter, chunk_size):
+        """
+        Splits a stream of text segments incrementally. Text is buffered
+        until it spans several chunks, every chunk but the last is emitted
+        and the last one is carried over so boundaries and overlap match a
+        split of the whole document.
+
+        Yields:
+            Tuples of (chunk, start, end), the character offsets of the chunk
+            in the segments joined by newlines.
+        """
+        buffer = ""
+        # offset of the buffer and of the next segment in the document text
+        buffer_start = 0
+        position = 0
+        for i, segment in enumerate(s for s in segments if s is not None):
+            if i > 0:
+                position += 1  # the newline joining segments
+            if buffer:
+                buffer = f"{buffer}\n{segment}"
+            else:
+                buffer = segment
+                buffer_start = position
+            position += len(segment)
+            if len(buffer) < chunk_size * self.SPLIT_BUFFER_CHUNKS:
+                continue
+            chunks = splitter.split_text(buffer)
+            if len(chunks) < 2:
+                continue
+            yield from self.locate_chunks(buffer, chunks[:-1], buffer_start)
+            tail = buffer.rfind(chunks[-1])
+            if tail < 0:
+                tail = max(len(buffer) - len(chunks[-1]), 0)
+            buffer = buffer[tail:]
+            buffer_start += tail
+        if buffer:
+            yield from self.locate_chunks(
+                buffer, splitter.split_text(buffer), buffer_start
+            )
+
+    def locate_chunks(self, text, chunks, offset=0):
+        """Yields (chunk, start, end) for chunks split from text in order."""
+        search = 0
+        for chunk in chunks:
+            start = text.find(chunk, search)
+            if start >= 0:
+                end = start + len(chunk)
+            else:
+                # the splitter collapsed separators, locate the first and last lines
+                lines = chunk.split("\n")
+                start = text.find(lines[0], search)
+                if start < 0:
+                    start = search
+                end = text.find(lines[-1], start + len(lines[0]))
+                end = end + len(lines[-1]) if end >= 0 else start + len(chunk)
+            search = start + 1
+            yield chunk, offset + start, offset + end
+
+    def iter_chunk_metadata(self, document, spans):
+        """Pairs chunk spans with the metadata that locates them in their document."""
+        ingested_at = time.time()
+        for ordinal, (chunk, start, end) in enumerate(spans):
+            yield chunk, {
+                "document": document.name,
+                "document_id": document.id,
+                "ingested_at": ingested_at,
+                "ordinal": ordinal,
+                "start": start,
+                "end": end,
+            }
+
+    def get_file_digest(self, uploaded_file):
+        digest = hashlib.sha256()
+        uploaded_file.seek(0)
+        for block in iter(lambda: uploaded_file.read(self.TEXT_BLOCK_SIZE), b""):
+            digest.update(block)
+        uploaded_file.seek(0)
+        return digest.hexdigest()
+
+    def get_chunk_config(self, knowledge_store):
+        chunk_config = (
+            f"{knowledge_store.chunking_option}:{knowledge_store.chunk_size}:"
+            f"{knowledge_store.overlap}:{knowledge_store.embedding_backend}"
+        )
+        if knowledge_store.vector_backend != "chroma":
+            chunk_config += f":{knowledge_store.vector_backend}"
+        if knowledge_store.near_duplicate_threshold:
+            chunk_config += f":nd{knowledge_store.near_duplicate_threshold}"
+        return chunk_config
+
+    def ingest_chunks(
+        self, knowledge_store, chunks, progress_callback=None, stats=None
+    ):
+        """
+        Embeds and adds chunks in bounded batches, skipping any chunk whose id
+        is already in the collection. The batches of a window of
+        INGEST_CONCURRENT_BATCHES are embedded concurrently. Stores with a
+        near-duplicate threshold also skip chunks that are near-duplicates of a
+        chunk in the store, which stands in for them in the returned ids. If
+        ingestion fails, the chunks it added that no document records are
+        removed again.
+
+        Args:
+            knowledge_store: The KnowledgeStore to add to.
+            chunks: An iterable of chunk texts or (text, metadata) pairs.
+            progress_callback: Optional function called with the number of
+                chunks processed after every batch.
+            stats: Optional dict whose "near_duplicates" and "embeddings_saved"
+                counts are incremented by the chunks skipped as near-duplicates
+                and the embeddings that skipping them saved.
+
+        Returns:
+            A tuple of (all chunk ids, number of chunks added).
+        """
+        chunk_ids = []
+        processed = 0
+        added = 0
+        index = self.get_near_duplicate_index(knowledge_store)
+        # chunks added so far, removed again if ingestion fails
+        added_ids = []
+        try:
+            for window in batched(
+                batched(chunks, self.INGEST_BATCH_SIZE), self.INGEST_CONCURRENT_BATCHES
             ):
+                # ids that an earlier batch of the window adds
+                pending = set()
+                batches = []
+                for batch in window:
+                    # ids must be unique within a single add, the first chunk wins
+                    metadatas = {}
+                    for chunk in batch:
+                        text, metadata = (
+                            (chunk, None) if isinstance(chunk, str) else chunk
+                        )
+                        metadatas.setdefault(id_hash(text), (text, metadata))
+                    batch = {id: text for id, (text, _) in metadatas.items()}
+
+                    with self.read_store(knowledge_store) as collection:
+                        found = collection.get(
+                            ids=list(batch.keys()), include=["metadatas"]
+                        )
+                    existing = dict(zip(found["ids"], found["metadatas"]))
+                    new = {
+                        id: doc
+                        for id, doc in batch.items()
+                        if id not in existing and id not in pending
+                    }
+                    duplicates = {}
+                    if index is not None and new:
+                        new, duplicates = self.filter_near_duplicates(index, new)
+                        if duplicates and stats is not None:
+                            embedding_manager = self.get_embedding_manager(
+                                knowledge_store
+                            )
+                            # only a peek, the duplicates are never embedded
+                            _, missing = embedding_manager.lookup_embeddings(
+                                [batch[id] for id in duplicates], touch=False
+                            )
+                            stats["near_duplicates"] += len(duplicates)
+                            stats["embeddings_saved"] += len(missing)
+                    pending.update(new)
+                    chunk_ids.extend(duplicates.get(id, id) for id in batch)
+                    moved = self.get_moved_chunks(existing, metadatas)
+                    if moved:
+                        with self.write_store(knowledge_store) as collection:
+                            collection.update(
+                                ids=moved, metadatas=[metadatas[id][1] for id in moved]
+                            )
+                    batches.append((batch, metadatas, new, duplicates))
+
                 try:
-                    import docx
-
-                    doc = docx.Document(uploaded_file)
-                    fullText = []
-                    for para in doc.paragraphs:
-                        fullText.append(para.text)
-                    document = "\n".join(fullText)
-                except ImportError:
-                    raise Exception("Please install python-docx to read DOCX files.")
-        return document
-
-    def load_document(
-        self,
-        knowledge_store,
-        uploaded_file,
+                    # embed outside the lock so parallel ingestion is not serialized
+                    embeddings = self.embed_batches(
+                        knowledge_store,
+                        [list(new.values()) for _, _, new, _ in batches],
+                    )
+                    for (batch, metadatas, new, _), batch_embeddings in zip(
+                        batches, embeddings
+                    ):
+                        if new:
+                            with self.write_store(knowledge_store) as collection:
+                                collection.add(
+                                    embeddings=batch_embeddings,
+                                    documents=list(new.values()),
+                                    metadatas=[metadatas[id][1] for id in new],
+                                    ids=list(new.keys()),
+                                )
+                            added_ids.extend(new)
+                except Exception:
+                    if index is not None:
+                        index.remove(pending)
+                    raise
+
+                for batch, _, new, duplicates in batches:
+                    # chunks already in the collection may predate the keyword index
+                    indexed = [id for id in batch if id not in duplicates]
+                    self.keyword_index.add(
+                        knowledge_store.name, indexed, [batch[id] for id in indexed]
+                    )
+                    processed += len(batch)
+                    added += len(new)
+                    if progress_callback:
+                        progress_callback(processed)
+                if pending:
+                    rag_cache.bump_version("knowledge", knowledge_store.name)
+        except Exception:
+            # without an ingestion record nothing would ever delete them
+            self.remove_stale_chunks(knowledge_store, added_ids, [])
+            raise
+        return list(dict.fromkeys(chunk_ids)), added
+
+    def get_moved_chunks(self, existing, metadatas):
+        """
+        Returns:
+            The ids of chunks already in the collection whose metadata should
+            point at the document being ingested: chunks it had before, whose
+            position may have changed, and chunks of deleted documents. Chunks
+            another document shares keep pointing at that document.
+        """
+        moved = []
+        owners = {}
+        for id, metadata in existing.items():
+            new_metadata = metadatas[id][1]
+            if new_metadata is None:
+                continue
+            owner = (metadata or {}).get("document_id")
+            if owner is None or owner == new_metadata["document_id"]:
+                moved.append(id)
+            else:
+                owners[id] = owner
+        if owners:
+            live = {
+                document.id
+                for document in Document.select(Document.id).where(
+                    Document.id.in_(list(set(owners.values())))
+                )
+            }
+            moved.extend(id for id, owner in owners.items() if owner not in live)
+        return moved
+
+    def embed_batches(self, knowledge_store, batches):
+        """
+        Embeds several batches of texts with concurrent provider requests.
+
+        Returns:
+            A list with the embeddings of each batch.
+        """
+        if sum(1 for texts in batches if texts) <= 1:
+            return [
+                self.get_document_embeddings(texts, knowledge_store)
+                for texts in batches
+            ]
+        embedding_manager = self.get_embedding_manager(knowledge_store)
+
+        async def embed_all():
+            return await asyncio.gather(
+                *[embedding_manager.aget_embeddings(texts) for texts in batches]
+            )
+
+        return run_sync(embed_all())
+
+    def replace_ingestion_record(
+        self, knowledge_store, document_name, digest, chunk_config, chunk_ids
     ):
+        """
+        Records the chunks a document now has, replacing its previous record.
+        A digest of None keeps the digest of the previous record.
+
+        Returns:
+            The chunk ids of the replaced records.
+        """
+        # take the write lock up front so concurrent ingestion does not deadlock
+        with db.atomic("IMMEDIATE"):
+            previous = list(
+                IngestionRecord.select().where(
+                    (IngestionRecord.store == knowledge_store)
+                    & (IngestionRecord.document_name == document_name)
+                )
+            )
+            if digest is None:
+                digest = previous[0].digest if previous else ""
+            IngestionRecord.delete().where(
+                IngestionRecord.id.in_([r.id for r in previous])
+            ).execute()
+            IngestionRecord.create(
+                store=knowledge_store,
+                document_name=document_name,
+                digest=digest,
+                chunk_config=chunk_config,
+                chunk_ids=json.dumps(chunk_ids),
+            )
+        return sum([json.loads(r.chunk_ids) for r in previous], [])
+
+    def remove_stale_chunks(self, knowledge_store, old_ids, new_ids):
+        """Deletes chunks that a document no longer has and no other document uses."""
+        stale = set(old_ids) - set(new_ids)
+        if not stale:
+            return 0
+        for record in IngestionRecord.select().where(
+            IngestionRecord.store == knowledge_store
+        ):
+            stale -= set(json.loads(record.chunk_ids))
+        if stale:
+            with self.write_store(knowledge_store) as collection:
+                collection.delete(ids=list(stale))
+            self.keyword_index.delete(knowledge_store.name, stale)
+            index = self.near_duplicate_indexes.get(knowledge_store.name)
+            if index is not None:
+                index.remove(stale)
+            rag_cache.bump_version("knowledge", knowledge_store.name)
+        return len(stale)
+
+    def load_document(self, knowledge_store, uploaded_file, progress_callback=None):
         """
         Loads a document from upload, splits it based on chunking option and saves embeddings.
+        The document is streamed: text is extracted, split, embedded and added to the
+        collection in bounded batches so memory use does not grow with document size.
+
+        Ingestion is idempotent. A file whose digest was already ingested into the store
+        with the same chunking configuration is skipped, under another name the document
+        shares the chunks of the one ingested first. A changed file only embeds chunks
+        that are not in the collection yet and removes chunks it no longer contains.
 
         Args:
+            knowledge_store: The KnowledgeStore to load the document into.
             uploaded_file: A Streamlit file uploader object.
-            chunker: A Langchain TextSplitter object (CharacterTextSplitter or WordTextSplitter).
-            chunk_size: The size of each chunk.
-            overlap: The size of the overlap between chunks.
+            progress_callback: Optional function called with (chunks, segments)
+                processed so far after every batch is added.
+
+        Returns:
+            A summary dict of the ingestion, or None if nothing was loaded.
+        """
+        if knowledge_store is None or uploaded_file is None:
+            return None
+
+        document_name = uploaded_file.name
+        digest = self.get_file_digest(uploaded_file)
+        chunk_config = self.get_chunk_config(knowledge_store)
+        records = list(
+            IngestionRecord.select().where(
+                (IngestionRecord.store == knowledge_store)
+                & (IngestionRecord.digest == digest)
+                & (IngestionRecord.chunk_config == chunk_config)
+            )
+        )
+        if records:
+            record = next(
+                (r for r in records if r.document_name == document_name), records[0]
+            )
+            chunk_ids = json.loads(record.chunk_ids)
+            result = {
+                "document": document_name,
+                "skipped": True,
+                "chunks": len(chunk_ids),
+                "added": 0,
+                "removed": 0,
+            }
+            if record.document_name != document_name:
+                result["duplicate_of"] = record.document_name
+                result["removed"] = self.share_chunks(
+                    knowledge_store, record, document_name
+                )
+            return result
+
+        splitter = self.get_splitter(knowledge_store)
+        segments_read = [0]
+        # the extracted text is kept so the store can be re-chunked later
+        compressor = zlib.compressobj()
+        compressed = []
+
+        def counted_segments():
+            for segment in self.iter_file_text(uploaded_file):
+                if segment is not None:
+                    separator = "\n" if segments_read[0] else ""
+                    compressed.append(
+                        compressor.compress((separator + segment).encode("utf-8"))
+                    )
+                    segments_read[0] += 1
+                yield segment
+
+        def report_progress(chunks):
+            if progress_callback:
+                progress_callback(chunks, segments_read[0])
+
+        with db.atomic("IMMEDIATE"):
+            document, created = Document.get_or_create(
+                store=knowledge_store, name=document_name
+            )
+        chunks = self.iter_chunk_metadata(
+            document,
+            self.iter_chunk_spans(
+                counted_segments(), splitter, knowledge_store.chunk_size
+            ),
+        )
+        stats = {"near_duplicates": 0, "embeddings_saved": 0}
+        try:
+            chunk_ids, added = self.ingest_chunks(
+                knowledge_store, chunks, report_progress, stats
+            )
+        except Exception:
+            if created:
+                with db.atomic("IMMEDIATE"):
+                    document.delete_instance()
+            raise
+
+        compressed.append(compressor.flush())
+        with db.atomic("IMMEDIATE"):
+            document.text = b"".join(compressed)
+            document.save()
+        old_ids = self.replace_ingestion_record(
+            knowledge_store, document_name, digest, chunk_config, chunk_ids
+        )
+        removed = self.remove_stale_chunks(knowledge_store, old_ids, chunk_ids)
+
+        return {
+            "document": document_name,
+            "skipped": False,
+            "chunks": len(chunk_ids),
+            "added": added,
+            "removed": removed,
+            **stats,
+        }
+
+    def share_chunks(self, knowledge_store, record, document_name):
+        """
+        Records a document with the same content as an ingested one under its
+        own name, sharing the chunks and extracted text of the ingested one,
+        so deleting either document keeps the chunks the other uses.
 
         Returns:
-            None
+            The number of chunks removed that the document had before.
+        """
+        chunk_ids = json.loads(record.chunk_ids)
+        with db.atomic("IMMEDIATE"):
+            source = Document.get_or_none(
+                (Document.store == knowledge_store)
+                & (Document.name == record.document_name)
+            )
+            document, _ = Document.get_or_create(
+                store=knowledge_store, name=document_name
+            )
+            document.text = source.text if source is not None else None
+            document.save()
+        old_ids = self.replace_ingestion_record(
+            knowledge_store,
+            document_name,
+            record.digest,
+            record.chunk_config,
+            chunk_ids,
+        )
+        return self.remove_stale_chunks(knowledge_store, old_ids, chunk_ids)
+
+    def iter_document_text(self, document):
+        """Yields the stored text of a Document in newline aligned segments."""
+        decompressor = zlib.decompressobj()
+        data = bytes(document.text)
+        pending = b""
+        for start in range(0, len(data), self.TEXT_BLOCK_SIZE):
+            pending += decompressor.decompress(
+                data[start : start + self.TEXT_BLOCK_SIZE]
+            )
+            cut = pending.rfind(b"\n")
+            if cut >= 0:
+                yield pending[:cut].decode("utf-8")
+                pending = pending[cut + 1 :]
+        pending += decompressor.flush()
+        yield pending.decode("utf-8")
+
+    def rechunk_store(self, knowledge_store, progress_callback=None):
         """
-        if knowledge_store is not None and uploaded_file is not None:
-            document = self.read_file(uploaded_file)
+        Re-splits every document of a store from its stored text using the
+        store's current chunking configuration. Only chunks that are not in
+        the collection yet are embedded, and chunks no document uses anymore
+        are removed.
 
-            splitter = self.get_splitter(knowledge_store)
-            docs = splitter.create_documents([document])
+        Args:
+            knowledge_store: The KnowledgeStore to re-chunk.
+            progress_callback: Optional function called with
+                (documents done, total documents).
+
+        Returns:
+            A summary dict of the re-chunking.
+        """
+        splitter = self.get_splitter(knowledge_store)
+        chunk_config = self.get_chunk_config(knowledge_store)
+        documents = list(knowledge_store.documents)
+        summary = {
+            "documents": 0,
+            "skipped": [],
+            "chunks": 0,
+            "added": 0,
+            "removed": 0,
+            "near_duplicates": 0,
+            "embeddings_saved": 0,
+        }
 
-            embeddings = [self.get_document_embedding(doc) for doc in docs]
+        for i, document in enumerate(documents):
+            if document.text is None:
+                # uploaded before extracted text was kept, or compressed
+                summary["skipped"].append(document.name)
+                continue
 
-            # create chroma database client
-            chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-            # get or create a collection
-            collection = chroma_client.get_or_create_collection(
-                name=knowledge_store.name
+            chunks = self.iter_chunk_metadata(
+                document,
+                self.iter_chunk_spans(
+                    self.iter_document_text(document),
+                    splitter,
+                    knowledge_store.chunk_size,
+                ),
+            )
+            chunk_ids, added = self.ingest_chunks(
+                knowledge_store, chunks, stats=summary
             )
-            docs = [str(doc.page_content) for doc in docs]
-            ids = [id_hash(m) for m in docs]
 
-            collection.add(embeddings=embeddings, documents=docs, ids=ids)
-            return True
-        return False
+            old_ids = self.replace_ingestion_record(
+                knowledge_store, document.name, None, chunk_config, chunk_ids
+            )
+            summary["removed"] += self.remove_stale_chunks(
+                knowledge_store, old_ids, chunk_ids
+            )
+            summary["documents"] += 1
+            summary["chunks"] += len(chunk_ids)
+            summary["added"] += added
+            if progress_callback:
+                progress_callback(i + 1, len(documents))
+        return summary
 
-    def examine_documents(self, knowledge_store):
+    def examine_documents(self, knowledge_store, offset=0, limit=None):
         """
-        Displays all documents from ChromaDB.
+        Displays a page of documents from ChromaDB, or all of them without a limit.
         """
         if knowledge_store is None:
             return None
 
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collection = chroma_client.get_or_create_collection(name=knowledge_store)
-        documents = collection.get(include=["documents"])
+        documents = self.get_documents(
+            knowledge_store, include=["documents"], offset=offset, limit=limit
+        )
 
         df = pd.DataFrame(
             {"ID Hash": documents["ids"], "Document": documents["documents"]}
@@ -184,24 +1178,92 @@ class KnowledgeManager:
         # Display the DataFrame in Streamlit
         return df
 
+    def delete_document(self, knowledge_store, document_name):
+        """
+        Deletes a document and, in a single batched delete, the chunks that no
+        other document of the store shares.
+
+        Returns:
+            The number of chunks deleted, or None if the document does not exist.
+        """
+        knowledge_store = self.get_knowledge_store(knowledge_store)
+        if knowledge_store is None:
+            return None
+        with db.atomic("IMMEDIATE"):
+            records = list(
+                IngestionRecord.select().where(
+                    (IngestionRecord.store == knowledge_store)
+                    & (IngestionRecord.document_name == document_name)
+                )
+            )
+            deleted = (
+                Document.delete()
+                .where(
+                    (Document.store == knowledge_store)
+                    & (Document.name == document_name)
+                )
+                .execute()
+            )
+            IngestionRecord.delete().where(
+                IngestionRecord.id.in_([r.id for r in records])
+            ).execute()
+        if not deleted and not records:
+            return None
+        chunk_ids = sum([json.loads(r.chunk_ids) for r in records], [])
+        return self.remove_stale_chunks(knowledge_store, chunk_ids, [])
+
     def delete_knowledge_store(self, knowledge_store):
         if knowledge_store is None:
             return False
 
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        chroma_client.delete_collection(knowledge_store)
+        vector_store_pool.delete_collection(self.CHROMA_DB, knowledge_store)
+        self.keyword_index.delete_store(knowledge_store)
+        self.near_duplicate_indexes.pop(knowledge_store, None)
+        rag_cache.bump_version("knowledge", knowledge_store)
+        self.clear_ingestion_records(knowledge_store)
         return True
 
-    def compress_knowledge(self, knowledge_store, grouped_items, chat_agent):
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        chroma_client.delete_collection(knowledge_store.name)
-        collection = chroma_client.get_or_create_collection(name=knowledge_store.name)
+    def clear_ingestion_records(self, knowledge_store):
+        store = self.get_knowledge_store(knowledge_store)
+        if store is not None:
+            IngestionRecord.delete().where(IngestionRecord.store == store).execute()
+
+    def compress_knowledge(
+        self, knowledge_store, grouped_items, chat_agent, progress_callback=None
+    ):
+        """
+        Replaces the chunks of a store with statements summarized from each
+        cluster. Clusters are compressed concurrently on a bounded thread pool.
+        The stored text of the documents is dropped, so re-chunking the store
+        skips them.
+
+        Args:
+            knowledge_store: The KnowledgeStore to compress.
+            grouped_items: A dict of cluster label to the documents in it.
+            chat_agent: The agent used to summarize the clusters.
+            progress_callback: Optional function called with
+                (clusters done, total clusters).
+        """
+        backend, options = self.get_vector_config(knowledge_store)
+        vector_store_pool.reset_collection(
+            self.CHROMA_DB, knowledge_store.name, backend, **options
+        )
+        self.keyword_index.delete_store(knowledge_store.name)
+        self.near_duplicate_indexes.pop(knowledge_store.name, None)
+        rag_cache.bump_version("knowledge", knowledge_store.name)
+        # compressed statements replace the ingested chunks, and re-chunking
+        # the documents' text would add the originals back
+        self.clear_ingestion_records(knowledge_store)
+        with db.atomic("IMMEDIATE"):
+            Document.update(text=None).where(
+                Document.store == knowledge_store
+            ).execute()
 
         summarization_prompt = "Given a list of dodcuments described below, synthesize these into a concise narrative that captures their essence, significance, facts, important events, plot, and any common themes. Focus on the underlying statements, lessons learned, or how these documents collectively shape an understanding of a particular topic. Please merge similar documents and emphasize unique insights, facts and other information. The aim is to create a compact, meaningful representation of these documents that captures the pertinent information. "
         function_prompt = "Summarize the documents and create a set of statements that summarize the essence, significance, facts, important events, plot, names, places, and any common themes. Return a JSON object with the following keys: 'statements' and only that key. Return only the JSON object and nothing else."
         function_keys = "statements"
 
-        for key, items in grouped_items.items():
+        def compress_cluster(items):
             try:
                 # 1. create a list of memories
                 items = "\n".join(items)
@@ -224,14 +1286,14 @@ class KnowledgeManager:
                     [documents[key.lower()] for key in function_keys.split(",")],
                     [],
                 )
-                # 4. add the new memories to the collection
-                for document in documents:
-                    embedding = self.get_document_embedding(document)
-                    id = id_hash(document)
-                    docs = collection.get(ids=[id], include=["documents"])["documents"]
-                    if docs is None or len(docs) == 0:
-                        collection.add(
-                            embeddings=[embedding], documents=[document], ids=[id]
-                        )
+                # 4. add the new statements to the collection in one batch
+                self.ingest_chunks(knowledge_store, documents)
             except Exception as e:
                 print("Error compressing documents: ", e)
+
+        map_with_context(
+            compress_cluster,
+            grouped_items.values(),
+            self.COMPRESS_WORKERS,
+            progress_callback,
+        )
@@ -1,6 +1,5 @@
 import json
 
-import chromadb
 import pandas as pd
 from dotenv import load_dotenv
 from langchain_text_splitters import (
@@ -8,62 +7,227 @@ from langchain_text_splitters import (
     RecursiveCharacterTextSplitter,
 )
 
+from gpt_nexus.nexus_base.context_assembler import similarity_from_distance
 from gpt_nexus.nexus_base.embedding_manager import EmbeddingManager
 from gpt_nexus.nexus_base.nexus_models import MemoryStore, MemoryType, db
+from gpt_nexus.nexus_base.rag_cache import rag_cache
 from gpt_nexus.nexus_base.utils import (
     convert_keys_to_lowercase,
     extract_code,
     id_hash,
+    map_with_context,
 )
+from gpt_nexus.nexus_base.vector_store_pool import vector_store_pool
 
 load_dotenv()
 
 
 class MemoryManager:
+    # clusters summarized concurrently when compressing
+    COMPRESS_WORKERS = 4
+
     def __init__(self):
-        self.embedding_manager = EmbeddingManager()
+        self.embedding_managers = {}
+        self.embedding_manager = self.get_embedding_manager()
         self.CHROMA_DB = "nexus_memory_chroma_db"
         self.initialize_stores()
 
     def initialize_stores(self):
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collections = chroma_client.list_collections()
-        for collection in collections:
-            self.add_memory_store(collection.name)
+        collections = vector_store_pool.list_collections(self.CHROMA_DB)
+        for name, vector_backend in collections.items():
+            self.add_memory_store(name, vector_backend)
 
-    def add_memory_store(self, store_name):
+    def add_memory_store(self, store_name, vector_backend="chroma"):
         if store_name is None or store_name == "None":
             return False
         with db.atomic():
             if MemoryStore.select().where(MemoryStore.name == store_name).count() == 0:
-                MemoryStore.create(name=store_name)
+                MemoryStore.create(name=store_name, vector_backend=vector_backend)
                 return True
         return False
 
-    def get_memory_embedding(self, text):
-        return self.embedding_manager.get_embedding(text)
+    def get_memory_store(self, memory_store):
+        if isinstance(memory_store, MemoryStore):
+            return memory_store
+        return MemoryStore.select().where(MemoryStore.name == memory_store).first()
 
-    def query_memories(self, memory_store_name, input_text, n_results=5):
+    def check_embedding_backend(self, memory_store):
+        """
+        Raises a ValueError if the embedding backend of a store that already
+        holds embeddings was changed, as embeddings of different backends can
+        not be compared and may not even have the same dimensions.
+        """
+        saved = MemoryStore.get_or_none(MemoryStore.id == memory_store.id)
+        if (
+            saved is not None
+            and saved.embedding_backend != memory_store.embedding_backend
+            and self.count_memories(memory_store.name) > 0
+        ):
+            raise ValueError(
+                f"Memory store '{memory_store.name}' already has embeddings, "
+                "its embedding backend can only be changed while it is empty."
+            )
+
+    def get_vector_config(self, memory_store):
+        """
+        Returns:
+            A tuple of the vector store backend of a store and its options.
+        """
+        store = self.get_memory_store(memory_store)
+        if store is None:
+            return "chroma", {}
+        if store.vector_backend != "numpy":
+            return store.vector_backend, {}
+        return store.vector_backend, {
+            "precision": store.vector_precision,
+            "rescore": store.vector_rescore,
+        }
+
+    def read_store(self, memory_store):
+        """Returns a context manager yielding the store's vector store to read."""
+        backend, options = self.get_vector_config(memory_store)
+        return vector_store_pool.read(
+            self.CHROMA_DB,
+            getattr(memory_store, "name", memory_store),
+            backend,
+            **options,
+        )
+
+    def write_store(self, memory_store):
+        """Returns a context manager yielding the store's vector store to write."""
+        backend, options = self.get_vector_config(memory_store)
+        return vector_store_pool.write(
+            self.CHROMA_DB,
+            getattr(memory_store, "name", memory_store),
+            backend,
+            **options,
+        )
+
+    def get_embedding_manager(self, memory_store=None):
+        backend = "openai"
+        if memory_store is not None:
+            store = self.get_memory_store(memory_store)
+            if store is not None:
+                backend = store.embedding_backend
+        if backend not in self.embedding_managers:
+            self.embedding_managers[backend] = EmbeddingManager(backend)
+        return self.embedding_managers[backend]
+
+    def get_memory_embedding(self, text, memory_store=None):
+        return self.get_embedding_manager(memory_store).get_embedding(text)
+
+    def get_memory_embeddings(self, texts, memory_store=None):
+        return self.get_embedding_manager(memory_store).get_embeddings(texts)
+
+    def search_memories(self, memory_store_name, input_text, n_results=5):
+        """
+        Returns:
+            A list of (id, memory, similarity), most similar first. Results
+            are cached until the store changes.
+        """
         if memory_store_name is None or input_text is None:
             return None
 
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collection = chroma_client.get_or_create_collection(name=memory_store_name)
-        embedding = self.get_memory_embedding(input_text)
-        docs = collection.query(
-            query_embeddings=[embedding], n_results=n_results, include=["documents"]
+        return rag_cache.get_or_query(
+            "memory",
+            memory_store_name,
+            input_text,
+            n_results,
+            lambda: self.retrieve_memories(memory_store_name, input_text, n_results),
         )
-        return docs["documents"]
+
+    def retrieve_memories(self, memory_store_name, input_text, n_results):
+        embedding = self.get_memory_embedding(input_text, memory_store_name)
+        return [
+            (id, memory, similarity_from_distance(distance))
+            for id, memory, distance, _ in self.query_by_embedding(
+                memory_store_name, embedding, n_results
+            )
+        ]
+
+    def search_memories_batch(self, memory_store_name, input_texts, n_results=5):
+        """
+        Searches a store for several texts with one embedding call and one
+        vector query for the texts that are not cached.
+
+        Returns:
+            A list with the (id, memory, similarity) results of each text.
+        """
+        version = rag_cache.get_version("memory", memory_store_name)
+        keys = [
+            rag_cache.make_key("memory", memory_store_name, version, text, n_results)
+            for text in input_texts
+        ]
+        results = [rag_cache.get(key) for key in keys]
+        missing = [i for i, (found, _) in enumerate(results) if not found]
+        results = [value for _, value in results]
+        if missing:
+            embeddings = self.get_memory_embeddings(
+                [input_texts[i] for i in missing], memory_store_name
+            )
+            found = self.query_by_embeddings(memory_store_name, embeddings, n_results)
+            for i, docs in zip(missing, found):
+                results[i] = [
+                    (id, memory, similarity_from_distance(distance))
+                    for id, memory, distance, _ in docs
+                ]
+                rag_cache.put(keys[i], results[i])
+        return results
+
+    def query_memories(self, memory_store_name, input_text, n_results=5):
+        results = self.search_memories(memory_store_name, input_text, n_results)
+        if results is None:
+            return None
+        return [[memory for _, memory, _ in results]]
+
+    def query_by_embedding(self, memory_store_name, embedding, n_results=5):
+        """
+        Returns:
+            A list of (id, memory, distance, metadata) for the nearest memories.
+        """
+        return self.query_by_embeddings(memory_store_name, [embedding], n_results)[0]
+
+    def query_by_embeddings(self, memory_store_name, embeddings, n_results=5):
+        """
+        Queries the nearest memories of several embeddings in one query.
+
+        Returns:
+            A list with the (id, memory, distance, metadata) of each embedding.
+        """
+        with self.read_store(memory_store_name) as collection:
+            docs = collection.query(
+                query_embeddings=embeddings,
+                n_results=n_results,
+                include=["documents", "distances", "metadatas"],
+            )
+        return [
+            list(zip(ids, documents, distances, metadatas))
+            for ids, documents, distances, metadatas in zip(
+                docs["ids"], docs["documents"], docs["distances"], docs["metadatas"]
+            )
+        ]
 
     def apply_memory_RAG(
-        self, memory_store, memory_function, input_text, agent, n_results=5
+        self,
+        memory_store,
+        memory_function,
+        input_text,
+        agent,
+        n_results=5,
+        assembler=None,
+        model=None,
     ):
+        """
+        Builds the memory context for a prompt. With a ContextAssembler the
+        memories are cut off by similarity and packed into its token budget.
+        """
         if memory_store is None or input_text is None:
             return None
 
         # basic form of memory
         if memory_store.memory_type == MemoryType.CONVERSATIONAL.value:
-            docs = self.query_memories(memory_store.name, input_text, n_results)
+            results = self.search_memories(memory_store.name, input_text, n_results)
+            docs = self.pack_memories(memory_store, results, assembler, model)
 
             prompt = ""
             if docs:
@@ -89,10 +253,19 @@ class MemoryManager:
                 [],
             )
 
-            memories = []
-            for semantic in semantics:
-                docs = self.query_memories(memory_store.name, semantic, n_results)
-                memories.extend(docs)
+            # one embedding call and one query for every key, a memory found
+            # by several keys keeps its best similarity
+            semantics = list(dict.fromkeys(semantics))
+            results = {}
+            for found in self.search_memories_batch(
+                memory_store.name, semantics, n_results
+            ):
+                for id, memory, similarity in found:
+                    if id not in results or similarity > results[id][2]:
+                        results[id] = (id, memory, similarity)
+            memories = self.pack_memories(
+                memory_store, list(results.values()), assembler, model
+            )
 
             prompt = f"\nThe following memories are specific to {memory_function.augmentation_keys} and may help provide additional context:\n"
             for memory in memories:
@@ -100,12 +273,36 @@ class MemoryManager:
 
             return prompt
 
-    def get_memories(self, memory_store, include=["documents", "embeddings"]):
+    def pack_memories(self, memory_store, results, assembler=None, model=None):
+        chunks = [
+            (memory_store.name, memory, similarity) for _, memory, similarity in results
+        ]
+        if assembler is not None:
+            chunks = assembler.pack("memory", chunks, model)
+        return [chunk[1] for chunk in chunks]
+
+    def count_memories(self, memory_store):
+        if memory_store is None:
+            return 0
+        with self.read_store(memory_store) as collection:
+            return collection.count()
+
+    def get_memories(
+        self, memory_store, include=["documents", "embeddings"], offset=None, limit=None
+    ):
+        """
+        Gets the memories of a memory store, or one page of them.
+
+        Args:
+            memory_store: The name of the memory store.
+            include: The fields to return besides ids, an empty list returns ids only.
+            offset: The number of memories to skip.
+            limit: The maximum number of memories to return.
+        """
         if memory_store is None:
             return None
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collection = chroma_client.get_or_create_collection(name=memory_store)
-        memories = collection.get(include=include)
+        with self.read_store(memory_store) as collection:
+            memories = collection.get(include=include, offset=offset, limit=limit)
         return memories
 
     def get_splitter(self, memory_store):
@@ -125,15 +322,15 @@ class MemoryManager:
                 is_separator_regex=False,
             )
 
-    def examine_memories(self, memory_store):
+    def examine_memories(self, memory_store, offset=0, limit=None):
         """
-        Displays all documents from ChromaDB.
+        Displays a page of memories from ChromaDB, or all of them without a limit.
         """
         if memory_store is None:
             return None
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collection = chroma_client.get_or_create_collection(name=memory_store)
-        memories = collection.get(include=["documents"])
+        memories = self.get_memories(
+            memory_store, include=["documents"], offset=offset, limit=limit
+        )
 
         df = pd.DataFrame({"ID Hash": memories["ids"], "Memory": memories["documents"]})
 
@@ -143,13 +340,27 @@ class MemoryManager:
     def delete_memory_store(self, memory_store):
         if memory_store is None:
             return False
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        chroma_client.delete_collection(memory_store)
+        vector_store_pool.delete_collection(self.CHROMA_DB, memory_store)
+        rag_cache.bump_version("memory", memory_store)
         return True
 
     def append_memory(
-        self, memory_store, user_input, llm_response, memory_function=None, agent=None
+        self,
+        memory_store,
+        user_input,
+        llm_response,
+        memory_function=None,
+        agent=None,
+        raise_errors=False,
     ):
+        """
+        Extracts memories from an exchange with the memory function and adds
+        the new ones to the store.
+
+        Args:
+            raise_errors: Raise errors instead of logging them and returning
+                False, so callers can retry transient ones.
+        """
         if (
             memory_store is None
             or user_input is None
@@ -158,9 +369,6 @@ class MemoryManager:
         ):
             return False
 
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        collection = chroma_client.get_or_create_collection(name=memory_store.name)
-
         if llm_response is None:
             memory = f"""            
             {user_input}
@@ -190,26 +398,69 @@ class MemoryManager:
                 [],
             )
 
-            for memory in memories:
-                embedding = self.get_memory_embedding(memory)
-                id = id_hash(memory)
-                docs = collection.get(ids=[id], include=["documents"])["documents"]
-                if docs is None or len(docs) == 0:
-                    collection.add(embeddings=[embedding], documents=[memory], ids=[id])
-
+            # one existence check, one embedding call and one add
+            self.add_memories(memory_store, memories)
             return True
         except Exception as e:
+            if raise_errors:
+                raise
             print("Error appending memory: ", e)
             return False
 
+    def add_memories(self, memory_store, memories):
+        """
+        Adds memories that are not in the store yet with one existence check,
+        one embedding call for only the new memories and one add. A memory
+        added concurrently between the check and the add is ignored by the add.
+
+        Returns:
+            The number of memories added.
+        """
+        # ids must be unique within a single add
+        memories = dict(zip([id_hash(memory) for memory in memories], memories))
+        if not memories:
+            return 0
+        with self.read_store(memory_store) as collection:
+            existing = set(collection.get(ids=list(memories.keys()), include=[])["ids"])
+        new = {id: memory for id, memory in memories.items() if id not in existing}
+        if new:
+            embeddings = self.get_memory_embeddings(list(new.values()), memory_store)
+            with self.write_store(memory_store) as collection:
+                collection.add(
+                    embeddings=embeddings,
+                    documents=list(new.values()),
+                    ids=list(new.keys()),
+                )
+            rag_cache.bump_version("memory", memory_store.name)
+        return len(new)
+
     def compress_memories(
-        self, memory_store, grouped_memories, memory_function, chat_agent
+        self,
+        memory_store,
+        grouped_memories,
+        memory_function,
+        chat_agent,
+        progress_callback=None,
     ):
-        chroma_client = chromadb.PersistentClient(path=self.CHROMA_DB)
-        chroma_client.delete_collection(memory_store.name)
-        collection = chroma_client.get_or_create_collection(name=memory_store.name)
+        """
+        Replaces the memories of a store with memories summarized from each
+        cluster. Clusters are compressed concurrently on a bounded thread pool.
+
+        Args:
+            memory_store: The MemoryStore to compress.
+            grouped_memories: A dict of cluster label to the memories in it.
+            memory_function: The memory function of the store's memory type.
+            chat_agent: The agent used to summarize the clusters.
+            progress_callback: Optional function called with
+                (clusters done, total clusters).
+        """
+        backend, options = self.get_vector_config(memory_store)
+        vector_store_pool.reset_collection(
+            self.CHROMA_DB, memory_store.name, backend, **options
+        )
+        rag_cache.bump_version("memory", memory_store.name)
 
-        for key, items in grouped_memories.items():
+        def compress_cluster(items):
             try:
                 # 1. create a list of memories
                 items = "\n".join(items)
@@ -235,14 +486,14 @@ class MemoryManager:
                     ],
                     [],
                 )
-                # 4. add the new memories to the collection
-                for memory in memories:
-                    embedding = self.get_memory_embedding(memory)
-                    id = id_hash(memory)
-                    docs = collection.get(ids=[id], include=["documents"])["documents"]
-                    if docs is None or len(docs) == 0:
-                        collection.add(
-                            embeddings=[embedding], documents=[memory], ids=[id]
-                        )
+                # 4. add the new memories to the collection in one batch
+                self.add_memories(memory_store, memories)
             except Exception as e:
                 print("Error compressing memories: ", e)
+
+        map_with_context(
+            compress_cluster,
+            grouped_memories.values(),
+            self.COMPRESS_WORKERS,
+            progress_callback,
+        )
@@ -0,0 +1,144 @@
+import contextvars
+import queue
+import threading
+import time
+
+
+class MemoryWriteQueue:
+    """
+    Write-behind queue that runs memory appends on a background worker so
+    they stay off the chat response path. Every job runs in a copy of the
+    context it was enqueued from, so token usage is tracked against the
+    conversation that produced it. A job that raises an error is_retryable
+    accepts is retried with exponential backoff. Other errors and a False
+    result fail the job at once, as retrying would repeat the same work.
+    """
+
+    def __init__(
+        self,
+        write_fn,
+        is_retryable=None,
+        max_retries=3,
+        backoff_base=1.0,
+        backoff_max=30.0,
+    ):
+        self.write_fn = write_fn
+        self.is_retryable = is_retryable or (lambda error: False)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # signalled whenever a job finishes, for flush
+        self._done = threading.Condition(self._lock)
+        self._pending = {}
+        self._next_id = 0
+        self._worker = None
+        self._stopped = False
+        self.processed = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def enqueue(self, *args):
+        """
+        Queues a call of write_fn with args.
+
+        Returns:
+            False if the queue was shut down and the call was dropped.
+        """
+        with self._lock:
+            if self._stopped:
+                return False
+            job_id = self._next_id
+            self._next_id += 1
+            self._pending[job_id] = time.monotonic()
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self.run, name="memory-write-behind", daemon=True
+                )
+                self._worker.start()
+        self._queue.put((job_id, contextvars.copy_context(), args))
+        return True
+
+    def run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job_id, context, args = job
+            succeeded = self.process(context, args)
+            with self._lock:
+                lag = time.monotonic() - self._pending.pop(job_id)
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                if succeeded:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+                self._done.notify_all()
+
+    def process(self, context, args):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                time.sleep(
+                    min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max)
+                )
+            try:
+                return context.run(self.write_fn, *args) is not False
+            except Exception as e:
+                print("Error writing memory: ", e)
+                if not self.is_retryable(e):
+                    return False
+        return False
+
+    def flush(self, timeout=None):
+        """
+        Waits for every queued job to finish.
+
+        Returns:
+            True if the queue drained before the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._done.wait(remaining)
+        return True
+
+    def shutdown(self, timeout=30.0):
+        """Stops accepting jobs, drains the queue and stops the worker."""
+        with self._lock:
+            self._stopped = True
+            worker = self._worker
+        drained = self.flush(timeout)
+        if worker is not None:
+            self._queue.put(None)
+            worker.join(timeout=1.0)
+        return drained
+
+    def get_stats(self):
+        """
+        Returns:
+            The queue depth, including the job in progress, the age of the
+            oldest pending job and the outcome counts and lag of finished
+            jobs, in seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "depth": len(self._pending),
+                "oldest_lag": (
+                    now - min(self._pending.values()) if self._pending else 0.0
+                ),
+                "processed": self.processed,
+                "failed": self.failed,
+                "retries": self.retries,
+                "last_lag": self.last_lag,
+                "max_lag": self.max_lag,
+            }
@@ -0,0 +1,116 @@
+import threading
+import zlib
+
+import numpy as np
+
+# a Mersenne prime above every 31 bit shingle hash, so a * hash stays in 64 bits
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+class MinHashIndex:
+    """
+    Finds near-duplicate texts with MinHash signatures over word shingles and
+    locality sensitive hashing. Signatures are split into bands and texts that
+    share a band bucket are compared on their estimated Jaccard similarity.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, shingle_size=3, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = self.get_bands(threshold, num_perm)
+        generator = np.random.default_rng(seed)
+        self.a = generator.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = generator.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = {}
+
+    @staticmethod
+    def get_bands(threshold, num_perm):
+        """Picks the bands and rows whose LSH threshold (1/b)^(1/r) is closest."""
+        options = [
+            (bands, num_perm // bands)
+            for bands in range(1, num_perm + 1)
+            if num_perm % bands == 0
+        ]
+        return min(
+            options,
+            key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold),
+        )
+
+    def shingles(self, text):
+        # numbers are kept, chunks that differ only in figures are different content
+        words = text.lower().split()
+        if len(words) < self.shingle_size:
+            return {" ".join(words)}
+        return {
+            " ".join(words[i : i + self.shingle_size])
+            for i in range(len(words) - self.shingle_size + 1)
+        }
+
+    def signature(self, text):
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in self.shingles(text)),
+            dtype=np.uint64,
+        )
+        hashes %= np.uint64(MERSENNE_PRIME)
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % np.uint64(
+            MERSENNE_PRIME
+        )
+        return permuted.min(axis=1)
+
+    def band_keys(self, signature):
+        return [
+            signature[i * self.rows : (i + 1) * self.rows].tobytes()
+            for i in range(self.bands)
+        ]
+
+    def find(self, signature):
+        """Returns the id of an indexed near-duplicate, or None."""
+        candidates = set()
+        for buckets, key in zip(self._buckets, self.band_keys(signature)):
+            candidates |= buckets.get(key, set())
+        for id in candidates:
+            if np.mean(self._signatures[id] == signature) >= self.threshold:
+                return id
+        return None
+
+    def add(self, id, signature):
+        self._signatures[id] = signature
+        for buckets, key in zip(self._buckets, self.band_keys(signature)):
+            buckets.setdefault(key, set()).add(id)
+
+    def add_if_unique(self, id, text):
+        """
+        Indexes a text unless it is a near-duplicate of an indexed one.
+
+        Returns:
+            The id of the near-duplicate, or None if the text was added.
+        """
+        signature = self.signature(text)
+        with self._lock:
+            if id in self._signatures:
+                return None
+            duplicate = self.find(signature)
+            if duplicate is None:
+                self.add(id, signature)
+            return duplicate
+
+    def add_many(self, ids, texts):
+        signatures = [self.signature(text) for text in texts]
+        with self._lock:
+            for id, signature in zip(ids, signatures):
+                self.add(id, signature)
+
+    def remove(self, ids):
+        with self._lock:
+            for id in ids:
+                signature = self._signatures.pop(id, None)
+                if signature is None:
+                    continue
+                for buckets, key in zip(self._buckets, self.band_keys(signature)):
+                    buckets.get(key, set()).discard(id)
+
+    def __len__(self):
+        return len(self._signatures)
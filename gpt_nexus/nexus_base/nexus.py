@@ -1,16 +1,25 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 
 from peewee import *
 
 from gpt_nexus.nexus_base.action_manager import ActionManager
 from gpt_nexus.nexus_base.agent_manager import AgentManager
 from gpt_nexus.nexus_base.assistants_manager import AssistantsManager
+from gpt_nexus.nexus_base.context_assembler import ContextAssembler
 from gpt_nexus.nexus_base.context_variables import (
     tracking_function_context,
     tracking_id_context,
 )
+from gpt_nexus.nexus_base.embedding_manager import (
+    get_embedding_backend_names,
+    is_retryable,
+)
 from gpt_nexus.nexus_base.knowledge_manager import KnowledgeManager
 from gpt_nexus.nexus_base.memory_manager import MemoryManager
+from gpt_nexus.nexus_base.memory_queue import MemoryWriteQueue
 from gpt_nexus.nexus_base.nexus_models import (
     ChatParticipants,
     Document,
@@ -24,8 +33,13 @@ from gpt_nexus.nexus_base.nexus_models import (
     db,
 )
 from gpt_nexus.nexus_base.profile_manager import ProfileManager
+from gpt_nexus.nexus_base.rag_cache import rag_cache
 from gpt_nexus.nexus_base.thought_template_manager import ThoughtTemplateManager
 from gpt_nexus.nexus_base.tracking_manager import TrackingManager
+from gpt_nexus.nexus_base.vector_store import (
+    get_vector_precision_names,
+    get_vector_store_backend_names,
+)
 
 
 class Nexus:
@@ -45,6 +59,13 @@ class Nexus:
 
         self.knowledge_manager = KnowledgeManager()
         self.memory_manager = MemoryManager()
+        # appends memories in the background, off the chat response path
+        self.memory_queue = MemoryWriteQueue(
+            partial(self.append_memory, raise_errors=True), is_retryable
+        )
+        atexit.register(self.memory_queue.shutdown)
+        # limits how much retrieved context is added to prompts
+        self.context_assembler = ContextAssembler()
 
         self.thought_template_manager = ThoughtTemplateManager(self)
 
@@ -356,6 +377,8 @@ class Nexus:
         )
 
     def update_knowledge_store(self, knowledge_store):
+        self.knowledge_manager.check_embedding_backend(knowledge_store)
+        self.knowledge_manager.check_vector_backend(knowledge_store)
         with db.atomic():
             knowledge_store.save()
             return True
@@ -383,7 +406,7 @@ class Nexus:
         with db.atomic():
             try:
                 store = KnowledgeStore.get(KnowledgeStore.name == store_name)
-                Document.create(store=store, name=document_name)
+                Document.get_or_create(store=store, name=document_name)
                 return True
             except KnowledgeStore.DoesNotExist:
                 return False  # Store does not exist
@@ -391,16 +414,9 @@ class Nexus:
             #     return False  # Document with the same name already exists in the store
 
     def delete_document_from_store(self, store_name, document_name):
-        """Delete a document from a knowledge store."""
-        with db.atomic():
-            try:
-                store = KnowledgeStore.get(KnowledgeStore.name == store_name)
-                query = Document.delete().where(
-                    (Document.store == store) & (Document.name == document_name)
-                )
-                return query.execute()  # Returns the number of rows deleted
-            except KnowledgeStore.DoesNotExist:
-                return False  # Store does not exist
+        """Delete a document and its chunks from a knowledge store."""
+        deleted = self.knowledge_manager.delete_document(store_name, document_name)
+        return deleted is not None
 
     def get_knowledge_store_names(self):
         return [store.name for store in KnowledgeStore.select()]
@@ -412,27 +428,153 @@ class Nexus:
         except KnowledgeStore.DoesNotExist:
             return []  # Store does not exist
 
-    def get_document_embedding(self, input_text, model="text-embedding-3-small"):
-        return self.knowledge_manager.get_document_embedding(input_text, model)
+    def get_document_embedding(self, input_text, knowledge_store=None):
+        return self.knowledge_manager.get_document_embedding(
+            input_text, knowledge_store
+        )
+
+    def query_documents(
+        self, knowledge_store, query, n_results=5, mode=None, where=None
+    ):
+        return self.knowledge_manager.query_documents(
+            knowledge_store, query, n_results, mode, where
+        )
+
+    def get_query_modes(self):
+        return self.knowledge_manager.QUERY_MODES
+
+    def get_documents(
+        self,
+        knowledge_store,
+        include=["documents", "embeddings"],
+        offset=None,
+        limit=None,
+    ):
+        return self.knowledge_manager.get_documents(
+            knowledge_store, include, offset, limit
+        )
 
-    def query_documents(self, knowledge_store, query, n_results=5):
-        return self.knowledge_manager.query_documents(knowledge_store, query, n_results)
+    def count_documents(self, knowledge_store):
+        return self.knowledge_manager.count_documents(knowledge_store)
 
-    def get_documents(self, knowledge_store, include=["documents", "embeddings"]):
-        return self.knowledge_manager.get_documents(knowledge_store, include)
+    def load_document(self, knowledge_store, uploaded_file, progress_callback=None):
+        knowledge_store = KnowledgeStore.get(KnowledgeStore.name == knowledge_store)
+        return self.knowledge_manager.load_document(
+            knowledge_store, uploaded_file, progress_callback
+        )
 
-    def load_document(self, knowledge_store, uploaded_file):
+    def rechunk_knowledge_store(self, knowledge_store, progress_callback=None):
         knowledge_store = KnowledgeStore.get(KnowledgeStore.name == knowledge_store)
-        return self.knowledge_manager.load_document(knowledge_store, uploaded_file)
+        return self.knowledge_manager.rechunk_store(knowledge_store, progress_callback)
 
-    def examine_documents(self, knowledge_store):
-        return self.knowledge_manager.examine_documents(knowledge_store)
+    def examine_documents(self, knowledge_store, offset=0, limit=None):
+        return self.knowledge_manager.examine_documents(knowledge_store, offset, limit)
 
-    def apply_knowledge_RAG(self, knowledge_store, input_text, n_results=5):
+    def apply_knowledge_RAG(
+        self, knowledge_store, input_text, n_results=5, mode=None, model=None
+    ):
         return self.knowledge_manager.apply_knowledge_RAG(
-            knowledge_store, input_text, n_results
+            knowledge_store,
+            input_text,
+            n_results,
+            mode,
+            self.context_assembler,
+            model,
         )
 
+    def query_stores(self, stores, query, k=5, mode=None):
+        """
+        Queries several knowledge and memory stores concurrently through their
+        cached searches and merges the results by similarity. Stores that use
+        the same embedding model share one embedding of the query, through the
+        embedding cache and request coalescing. Similarities are only
+        comparable between stores that use the same embedding backend.
+
+        Args:
+            stores: A list of store names, which are knowledge stores, or
+                ("knowledge" | "memory", name) tuples.
+            query: The query text.
+            k: The number of results to return across all stores.
+            mode: The query mode of the knowledge stores, None uses the
+                query mode of each store.
+
+        Returns:
+            A list of dicts with kind, store, id, document, similarity and
+            metadata, best first. Keyword matches have no similarity and come
+            after the others, ordered by their rank in their store.
+        """
+        targets = []
+        for store in stores or []:
+            kind, name = store if isinstance(store, tuple) else ("knowledge", store)
+            if kind not in ("knowledge", "memory"):
+                raise ValueError(f"Unknown store kind: {kind}")
+            if name is not None and name != "None":
+                targets.append((kind, name))
+        if not targets or query is None:
+            return []
+
+        def query_store(target):
+            kind, name = target
+            if kind == "knowledge":
+                results = self.knowledge_manager.search_documents(name, query, k, mode)
+            else:
+                results = [
+                    (id, memory, similarity, None)
+                    for id, memory, similarity in self.memory_manager.search_memories(
+                        name, query, k
+                    )
+                ]
+            return [
+                {
+                    "kind": kind,
+                    "store": name,
+                    "id": id,
+                    "document": document,
+                    "similarity": similarity,
+                    "metadata": metadata,
+                    "rank": rank,
+                }
+                for rank, (id, document, similarity, metadata) in enumerate(results)
+            ]
+
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            results = sum(executor.map(query_store, targets), [])
+        results.sort(
+            key=lambda result: (
+                result["similarity"] is None,
+                -(result["similarity"] or 0),
+                result["rank"],
+            )
+        )
+        return results[:k]
+
+    def apply_knowledge_stores_RAG(
+        self, knowledge_stores, input_text, n_results=5, mode=None, model=None
+    ):
+        """Builds a knowledge prompt from the best documents across several stores."""
+        results = self.query_stores(knowledge_stores, input_text, n_results, mode)
+        chunks = self.knowledge_manager.stitch_chunks(
+            [
+                (
+                    result["store"],
+                    result["document"],
+                    result["similarity"],
+                    result["metadata"],
+                )
+                for result in results
+            ]
+        )
+        chunks = self.context_assembler.pack("knowledge", chunks, model)
+        prompt = ""
+        if chunks:
+            prompt += "\nUse the following documents to help answer the question:\n"
+            for i, (_, document) in enumerate(chunks):
+                prompt += f"Document {i+1}:\n{document}\n"
+        return prompt
+
+    def get_context_stats(self):
+        return self.context_assembler.get_stats()
+
     def add_memory_store(self, store_name):
         """Add a new memory store."""
         return self.memory_manager.add_memory_store(store_name)
@@ -440,14 +582,19 @@ class Nexus:
     def get_memory_store_names(self):
         return [store.name for store in MemoryStore.select()]
 
-    def get_memory_embedding(self, input_text, model="text-embedding-3-small"):
-        return self.memory_manager.get_memory_embedding(input_text, model)
+    def get_memory_embedding(self, input_text, memory_store=None):
+        return self.memory_manager.get_memory_embedding(input_text, memory_store)
 
     def query_memories(self, memory_store, query, n_results=5):
         return self.memory_manager.query_memories(memory_store, query, n_results)
 
-    def get_memories(self, memory_store, include=["documents", "embeddings"]):
-        return self.memory_manager.get_memories(memory_store, include)
+    def get_memories(
+        self, memory_store, include=["documents", "embeddings"], offset=None, limit=None
+    ):
+        return self.memory_manager.get_memories(memory_store, include, offset, limit)
+
+    def count_memories(self, memory_store):
+        return self.memory_manager.count_memories(memory_store)
 
     def load_memory(self, memory_store, memory, agent):
         if memory_store is None or memory is None:
@@ -461,8 +608,8 @@ class Nexus:
         self.set_tracking_function("Not Set")
         return result
 
-    def examine_memories(self, memory_store):
-        return self.memory_manager.examine_memories(memory_store)
+    def examine_memories(self, memory_store, offset=0, limit=None):
+        return self.memory_manager.examine_memories(memory_store, offset, limit)
 
     def apply_memory_RAG(self, memory_store, input_text, agent, n_results=5):
         if memory_store is None or memory_store == "None" or input_text is None:
@@ -471,7 +618,13 @@ class Nexus:
         memory_function = self.get_memory_function(memory_store.memory_type)
         self.set_tracking_function("memory:augment")
         result = self.memory_manager.apply_memory_RAG(
-            memory_store, memory_function, input_text, agent, n_results
+            memory_store,
+            memory_function,
+            input_text,
+            agent,
+            n_results,
+            self.context_assembler,
+            getattr(agent, "model", None),
         )
         self.set_tracking_function("Not Set")
         return result
@@ -480,6 +633,7 @@ class Nexus:
         return MemoryStore.select().where(MemoryStore.name == memory_store).first()
 
     def update_memory_store(self, memory_store):
+        self.memory_manager.check_embedding_backend(memory_store)
         with db.atomic():
             memory_store.save()
             return True
@@ -495,43 +649,96 @@ class Nexus:
             memory_store.save()
             return True
 
-    def append_memory(self, memory_store, user_input, llm_response, agent):
+    def append_memory(
+        self, memory_store, user_input, llm_response, agent, raise_errors=False
+    ):
         if memory_store is None or user_input is None:
             return None
         memory_store = MemoryStore.get(MemoryStore.name == memory_store)
         memory_function = self.get_memory_function(memory_store.memory_type)
         self.set_tracking_function("memory:append")
         result = self.memory_manager.append_memory(
-            memory_store, user_input, llm_response, memory_function, agent
+            memory_store,
+            user_input,
+            llm_response,
+            memory_function,
+            agent,
+            raise_errors,
         )
         self.set_tracking_function("Not Set")
         return result
 
+    def enqueue_memory(self, memory_store, user_input, llm_response, agent):
+        """
+        Queues append_memory to run on the background memory worker with the
+        current tracking id, appends that fail with a transient provider error
+        are retried.
+        """
+        if memory_store is None or user_input is None:
+            return False
+        return self.memory_queue.enqueue(memory_store, user_input, llm_response, agent)
+
+    def flush_memory_queue(self, timeout=None):
+        return self.memory_queue.flush(timeout)
+
+    def get_memory_queue_stats(self):
+        return self.memory_queue.get_stats()
+
     def get_memory_function(self, memory_type):
         return MemoryFunction.get(MemoryFunction.memory_type == memory_type)
 
-    def compress_memories(self, memory_store, grouped_memories, chat_agent):
+    def compress_memories(
+        self, memory_store, grouped_memories, chat_agent, progress_callback=None
+    ):
         if memory_store is None or grouped_memories is None:
             return None
         memory_store = MemoryStore.get(MemoryStore.name == memory_store)
         memory_function = self.get_memory_function(memory_store.memory_type)
         self.set_tracking_function("memory:compress")
         result = self.memory_manager.compress_memories(
-            memory_store, grouped_memories, memory_function, chat_agent
+            memory_store,
+            grouped_memories,
+            memory_function,
+            chat_agent,
+            progress_callback,
         )
         self.set_tracking_function("Not Set")
         return result
 
-    def compress_knowledge(self, knowledge_store, grouped_documents, chat_agent):
+    def compress_knowledge(
+        self, knowledge_store, grouped_documents, chat_agent, progress_callback=None
+    ):
         if knowledge_store is None or grouped_documents is None:
             return None
         knowledge_store = KnowledgeStore.get(KnowledgeStore.name == knowledge_store)
         self.set_tracking_function("knowledge:compress")
         result = self.knowledge_manager.compress_knowledge(
-            knowledge_store, grouped_documents, chat_agent
+            knowledge_store, grouped_documents, chat_agent, progress_callback
         )
         self.set_tracking_function("Not Set")
         return result
 
+    def get_single_flight_stats(self):
+        return {
+            "embeddings": self.knowledge_manager.embedding_manager.get_single_flight_stats(),
+            "semantic_responses": self.agent_manager.get_single_flight_stats(),
+        }
+
+    def get_embedding_backend_names(self):
+        return get_embedding_backend_names()
+
+    def get_vector_store_backend_names(self):
+        return get_vector_store_backend_names()
+
+    def get_vector_precision_names(self):
+        return get_vector_precision_names()
+
     def get_tracking_usage(self):
         return self.tracking_manager.get_tracking_usage()
+
+    def get_rag_cache_stats(self):
+        return rag_cache.get_stats()
+
+    def get_embedding_cache_stats(self):
+        # both managers share the same process wide cache
+        return self.knowledge_manager.embedding_manager.get_cache_stats()
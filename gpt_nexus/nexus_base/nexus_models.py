@@ -3,14 +3,18 @@ from enum import Enum
 
 from peewee import (
     SQL,
+    BlobField,
+    BooleanField,
     CharField,
     DateTimeField,
+    FloatField,
     ForeignKeyField,
     IntegerField,
     Model,
     SqliteDatabase,
     TextField,
 )
+from playhouse.migrate import SqliteMigrator, migrate
 
 db = SqliteDatabase("nexus.db")
 
@@ -121,6 +125,16 @@ class KnowledgeStore(BaseModel):
     chunking_option = CharField(default="Character")
     chunk_size = IntegerField(default=512)
     overlap = IntegerField(default=128)
+    embedding_backend = CharField(default="openai")
+    vector_backend = CharField(default="chroma")
+    # storage precision of the numpy vector backend and whether its results
+    # are re-scored with float32 copies
+    vector_precision = CharField(default="float32")
+    vector_rescore = BooleanField(default=False)
+    # similarity above which a new chunk is skipped as a near-duplicate, 0 disables
+    near_duplicate_threshold = FloatField(default=0)
+    # retrieval mode of queries that do not name one, such as chat's
+    query_mode = CharField(default="vector")
 
 
 class MemoryType(Enum):
@@ -148,11 +162,30 @@ class MemoryStore(BaseModel):
         choices=[(m.value, m.name) for m in MemoryType],
         default=MemoryType.CONVERSATIONAL.value,
     )
+    embedding_backend = CharField(default="openai")
+    vector_backend = CharField(default="chroma")
+    # storage precision of the numpy vector backend and whether its results
+    # are re-scored with float32 copies
+    vector_precision = CharField(default="float32")
+    vector_rescore = BooleanField(default=False)
 
 
 class Document(BaseModel):
     store = ForeignKeyField(KnowledgeStore, backref="documents")
     name = CharField()
+    text = BlobField(null=True)  # zlib compressed extracted text
+
+
+class IngestionRecord(BaseModel):
+    store = ForeignKeyField(KnowledgeStore, backref="ingestions")
+    document_name = CharField()
+    digest = CharField(index=True)
+    chunk_config = CharField()
+    chunk_ids = TextField()  # JSON list of the chunk ids in the collection
+    timestamp = DateTimeField(constraints=[SQL("DEFAULT CURRENT_TIMESTAMP")])
+
+    class Meta:
+        indexes = ((("store", "digest", "chunk_config"), False),)
 
 
 class ThoughtTemplate(BaseModel):
@@ -162,24 +195,39 @@ class ThoughtTemplate(BaseModel):
     content = TextField()
 
 
+def migrate_db(models):
+    """Adds columns that were introduced after a table was first created."""
+    migrator = SqliteMigrator(db)
+    for model in models:
+        table = model._meta.table_name
+        columns = {column.name for column in db.get_columns(table)}
+        operations = [
+            migrator.add_column(table, field.column_name, field)
+            for field in model._meta.sorted_fields
+            if field.column_name not in columns
+        ]
+        if operations:
+            migrate(*operations)
+
+
 def initialize_db():
     db.connect()
-    db.create_tables(
-        [
-            AgentEngineUsage,
-            ChatParticipants,
-            Thread,
-            Message,
-            Subscriber,
-            Notification,
-            KnowledgeStore,
-            Document,
-            ThoughtTemplate,
-            MemoryStore,
-            MemoryFunction,
-        ],
-        safe=True,
-    )
+    models = [
+        AgentEngineUsage,
+        ChatParticipants,
+        Thread,
+        Message,
+        Subscriber,
+        Notification,
+        KnowledgeStore,
+        Document,
+        IngestionRecord,
+        ThoughtTemplate,
+        MemoryStore,
+        MemoryFunction,
+    ]
+    db.create_tables(models, safe=True)
+    migrate_db(models)
 
     # Add some initial data
     if (
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+from gpt_nexus.nexus_base.embedding_cache import normalize_text
+
+
+class RAGCache:
+    """
+    In-memory LRU cache of retrieved chunks keyed by
+    (kind, store, store version, normalized query, n_results). Every store
+    has a version that is bumped whenever its collection changes, which
+    drops its cached results. Entries also expire after a TTL so changes
+    made by other processes are picked up.
+    """
+
+    def __init__(self, max_entries=512, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_version(self, kind, store):
+        with self._lock:
+            return self._versions.get((kind, store), 0)
+
+    def bump_version(self, kind, store):
+        with self._lock:
+            version = self._versions.get((kind, store), 0) + 1
+            self._versions[(kind, store)] = version
+            for key in [key for key in self._entries if key[:2] == (kind, store)]:
+                del self._entries[key]
+            return version
+
+    def make_key(self, kind, store, version, query, n_results, *extra):
+        return (kind, store, version, normalize_text(query), n_results, *extra)
+
+    def get(self, key):
+        """
+        Returns:
+            A tuple of (found, value).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            # the store changed while the query ran
+            if self._versions.get(key[:2], 0) != key[2]:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_query(self, kind, store, query, n_results, fn, *extra):
+        """Returns the cached result of a query, running fn on a miss."""
+        key = self.make_key(
+            kind, store, self.get_version(kind, store), query, n_results, *extra
+        )
+        found, value = self.get(key)
+        if found:
+            return value
+        value = fn()
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+# shared by the knowledge and memory managers
+rag_cache = RAGCache()
@@ -1,8 +1,11 @@
 import asyncio
 import base64
+import contextvars
 import hashlib
 import re
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from queue import Queue
 
 
@@ -37,12 +40,109 @@ def async_to_sync_generator(async_gen):
         yield item
 
 
+def run_sync(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code, even when called
+    from a thread that already has a running event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # a loop is already running in this thread, so use a fresh one elsewhere
+    result = {}
+
+    def run_in_thread():
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run_in_thread, daemon=True)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
 # # Usage example assuming an async generator `async_gen_function`
 # async_gen = async_gen_function()  # Replace with your actual async generator
 # for item in async_to_sync_generator(async_gen):
 #     print(item)
 
 
+@lru_cache(maxsize=None)
+def get_encoding(model=None):
+    try:
+        import tiktoken
+
+        if model is not None:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                # not an OpenAI model, the default encoding is a close estimate
+                pass
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken is optional and needs to download its encodings
+        return None
+
+
+def count_tokens(text, model=None):
+    """
+    Counts the tokens of text with the tokenizer of model, or estimates them
+    from its length when tiktoken is not available.
+    """
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def map_with_context(fn, items, max_workers=4, progress_callback=None):
+    """
+    Calls fn on every item using a bounded thread pool. Each call runs in a
+    copy of the caller's context so context variables such as the tracking
+    id reach the workers.
+
+    Args:
+        fn: The function to call with each item.
+        items: The items to process.
+        max_workers: The maximum number of concurrent calls.
+        progress_callback: Optional function called on the calling thread
+            with (done, total) as calls complete.
+
+    Returns:
+        The results in the order of items.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, fn, item): i
+            for i, item in enumerate(items)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress_callback:
+                progress_callback(done, len(items))
+    return results
+
+
+def batched(iterable, size):
+    """Yields lists of up to size items from any iterable."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def id_hash(input_string, length=10):
     # Hash the input string using SHA-256
     hash_obj = hashlib.sha256(input_string.encode("utf-8"))
@@ -0,0 +1,106 @@
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from gpt_nexus.nexus_base.vector_store_pool import VectorStorePool
+
+
+def get_directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, _, files in os.walk(path)
+        for file in files
+    )
+
+
+# the configurations compared, as (label, backend, options)
+BENCHMARK_CONFIGS = [
+    ("chroma", "chroma", {}),
+    ("numpy", "numpy", {}),
+    ("numpy-float16", "numpy", {"precision": "float16"}),
+    ("numpy-int8", "numpy", {"precision": "int8"}),
+    ("numpy-int8-rescore", "numpy", {"precision": "int8", "rescore": True}),
+]
+
+
+def benchmark_vector_store(
+    pool, path, backend, options, vectors, queries, k, batch_size
+):
+    store = pool.reset_collection(path, "benchmark", backend, **options)
+    ids = [str(i) for i in range(len(vectors))]
+    start = time.perf_counter()
+    for i in range(0, len(vectors), batch_size):
+        store.add(
+            ids=ids[i : i + batch_size],
+            embeddings=vectors[i : i + batch_size].tolist(),
+            documents=ids[i : i + batch_size],
+        )
+    add_seconds = time.perf_counter() - start
+
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        found = store.query(query_embeddings=[query.tolist()], n_results=k)
+        latencies.append(time.perf_counter() - start)
+        results.append([int(id) for id in found["ids"][0]])
+    return {
+        "add_seconds": round(add_seconds, 3),
+        "query_ms_mean": round(statistics.mean(latencies) * 1000, 3),
+        "query_ms_p95": round(
+            sorted(latencies)[int(len(latencies) * 0.95) - 1] * 1000, 3
+        ),
+        "disk_bytes": get_directory_size(path),
+    }, results
+
+
+def benchmark_vector_stores(
+    size=10000, dimensions=1536, queries=100, k=5, batch_size=256, seed=0
+):
+    """
+    Compares the vector store backends and NumPy storage precisions on random
+    unit vectors.
+
+    Args:
+        size: The number of vectors stored.
+        dimensions: The dimensions of the vectors.
+        queries: The number of queries timed.
+        k: The number of results per query.
+        batch_size: The number of vectors per add.
+
+    Returns:
+        A dict of configuration to its add time, query latencies, disk use and
+        recall@k against an exact search.
+    """
+    generator = np.random.default_rng(seed)
+    vectors = generator.standard_normal((size, dimensions), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # queries near stored vectors, as real queries are near their answers
+    query_vectors = vectors[generator.integers(0, size, queries)] + (
+        0.5 * generator.standard_normal((queries, dimensions), dtype=np.float32)
+    ) / np.sqrt(dimensions)
+    exact = np.argsort(-(query_vectors @ vectors.T), axis=1)[:, :k]
+
+    summary = {"size": size, "dimensions": dimensions, "queries": queries, "k": k}
+    for label, backend, options in BENCHMARK_CONFIGS:
+        with tempfile.TemporaryDirectory() as path:
+            pool = VectorStorePool()
+            stats, results = benchmark_vector_store(
+                pool, path, backend, options, vectors, query_vectors, k, batch_size
+            )
+            stats["recall"] = round(
+                float(
+                    np.mean(
+                        [
+                            len(set(found) & set(expected)) / k
+                            for found, expected in zip(results, exact.tolist())
+                        ]
+                    )
+                ),
+                4,
+            )
+            summary[label] = stats
+    return summary
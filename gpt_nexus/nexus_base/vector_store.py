@@ -0,0 +1,572 @@
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class VectorStore:
+    """
+    A collection of embeddings with their ids, documents and metadata. The
+    methods follow the Chroma collection API, including the shape of the
+    dicts returned by get and query, and distances are squared L2 between
+    unit length embeddings.
+    """
+
+    name = "base"
+
+    def count(self):
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+    def get(self, ids=None, where=None, include=None, offset=None, limit=None):
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+    def update(self, ids, metadatas):
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+    def delete(self, ids):
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        raise NotImplementedError("This method should be implemented by subclasses.")
+
+
+class ChromaVectorStore(VectorStore):
+    """A Chroma collection, which keeps an HNSW index next to a SQLite table."""
+
+    name = "chroma"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def count(self):
+        return self.collection.count()
+
+    def get(self, ids=None, where=None, include=None, offset=None, limit=None):
+        return self.collection.get(
+            ids=ids,
+            where=where,
+            include=["documents", "metadatas"] if include is None else include,
+            offset=offset,
+            limit=limit,
+        )
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        self.collection.add(
+            ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas
+        )
+
+    def update(self, ids, metadatas):
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=(
+                ["documents", "metadatas", "distances"] if include is None else include
+            ),
+        )
+
+
+def matches_where(metadata, where):
+    """Evaluates a Chroma where filter against the metadata of one entry."""
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, c) for c in condition):
+                return False
+        elif not matches_condition(metadata.get(key), condition):
+            return False
+    return True
+
+
+def matches_condition(value, condition):
+    if not isinstance(condition, dict):
+        return value == condition
+    for operator, operand in condition.items():
+        if operator == "$eq":
+            matched = value == operand
+        elif operator == "$ne":
+            matched = value != operand
+        elif operator == "$in":
+            matched = value in operand
+        elif operator == "$nin":
+            matched = value not in operand
+        elif value is None:
+            matched = False
+        elif operator == "$gt":
+            matched = value > operand
+        elif operator == "$gte":
+            matched = value >= operand
+        elif operator == "$lt":
+            matched = value < operand
+        elif operator == "$lte":
+            matched = value <= operand
+        else:
+            raise ValueError(f"Unsupported where operator: {operator}")
+        if not matched:
+            return False
+    return True
+
+
+# storage precisions of the NumPy backend
+PRECISIONS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+def quantize(vectors, precision):
+    """
+    Converts float32 vectors to a storage precision. int8 vectors are scaled
+    per vector so their largest component maps to 127.
+
+    Returns:
+        A tuple of (quantized vectors, per vector scales or None).
+    """
+    if precision == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    return vectors.astype(PRECISIONS[precision]), None
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Keeps normalized embeddings in an append-only memory-mapped .npy matrix
+    and their ids, documents and metadata in a SQLite sidecar table keyed by
+    row. A query is one matrix product over every row followed by
+    argpartition, which beats an HNSW index on small and medium stores.
+
+    Embeddings are stored as float32, float16 or int8 with a scale per
+    vector, and a scan runs on the stored precision. With rescore, a float32
+    copy is kept on disk and the best candidates of the scan are re-ranked
+    with it, which costs disk but only touches a few of its pages per query.
+    Changing the precision of an existing store converts its files on open.
+
+    Deleted rows are masked out and reclaimed by compacting the matrix once
+    they make up most of it.
+    """
+
+    name = "numpy"
+
+    INITIAL_CAPACITY = 1024
+    SQLITE_MAX_VARIABLES = 900
+    # rows widened to float32 at a time when scanning a quantized matrix
+    SCAN_BLOCK_ROWS = 256
+    # candidates re-scored with the float32 copy per result
+    RESCORE_CANDIDATES = 4
+    ARRAY_NAMES = ["embeddings", "scales", "exact"]
+
+    def __init__(self, path, precision="float32", rescore=False):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown vector precision '{precision}'.")
+        self.path = path
+        self.precision = precision
+        # float32 vectors are already exact
+        self.rescore = rescore and precision != "float32"
+        os.makedirs(path, exist_ok=True)
+        self._local = threading.local()
+        # keeps appends and deletes whole when the store is used without
+        # the read/write lock of the vector store pool
+        self._lock = threading.Lock()
+        with self.connection as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, "
+                "id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+            )
+        self.arrays = {}
+        self.load()
+
+    @property
+    def connection(self):
+        # sqlite connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(os.path.join(self.path, "rows.db"), timeout=30)
+            self._local.connection = connection
+        return connection
+
+    @property
+    def matrix(self):
+        return self.arrays.get("embeddings")
+
+    def get_array_path(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def get_array_names(self):
+        """Returns the arrays the precision and rescore option need."""
+        names = ["embeddings"]
+        if self.precision == "int8":
+            names.append("scales")
+        if self.rescore:
+            names.append("exact")
+        return names
+
+    def get_array_spec(self, name, dimensions):
+        """Returns the dtype and row shape of an array."""
+        if name == "embeddings":
+            return PRECISIONS[self.precision], (dimensions,)
+        if name == "scales":
+            return np.float32, ()
+        return np.float32, (dimensions,)
+
+    def load(self):
+        rows = [row for (row,) in self.connection.execute("SELECT row FROM rows")]
+        self.size = max(rows) + 1 if rows else 0
+        for name in self.ARRAY_NAMES:
+            if os.path.exists(self.get_array_path(name)):
+                self.arrays[name] = np.load(self.get_array_path(name), mmap_mode="r+")
+        if self.matrix is not None and (
+            self.matrix.dtype != PRECISIONS[self.precision]
+            or set(self.arrays) != set(self.get_array_names())
+        ):
+            self.convert()
+        capacity = 0 if self.matrix is None else len(self.matrix)
+        self.active = np.zeros(max(capacity, self.size), dtype=bool)
+        self.active[rows] = True
+
+    def write_array(self, name, capacity, dimensions, rows):
+        """Rewrites an array file with room for capacity rows, starting with rows."""
+        dtype, shape = self.get_array_spec(name, dimensions)
+        path = self.get_array_path(name)
+        temporary = path + ".tmp"
+        array = np.lib.format.open_memmap(
+            temporary, mode="w+", dtype=dtype, shape=(capacity, *shape)
+        )
+        if len(rows):
+            array[: len(rows)] = rows
+        array.flush()
+        del array
+        self.arrays.pop(name, None)
+        os.replace(temporary, path)
+        self.arrays[name] = np.load(path, mmap_mode="r+")
+
+    def convert(self):
+        """Rewrites the arrays of the store in its precision."""
+        capacity, dimensions = self.matrix.shape
+        vectors = self.get_embeddings(np.arange(self.size))
+        quantized, scales = quantize(vectors, self.precision)
+        rows = {"embeddings": quantized, "scales": scales, "exact": vectors}
+        for name in self.ARRAY_NAMES:
+            if name in self.get_array_names():
+                self.write_array(name, capacity, dimensions, rows[name])
+            elif name in self.arrays:
+                del self.arrays[name]
+                os.remove(self.get_array_path(name))
+
+    def allocate(self, rows, dimensions):
+        """Grows the array files so they can hold at least rows embeddings."""
+        if self.matrix is not None and len(self.matrix) >= rows:
+            return
+        capacity = max(self.INITIAL_CAPACITY, rows)
+        if self.matrix is not None:
+            capacity = max(capacity, len(self.matrix) * 2)
+        for name in self.get_array_names():
+            array = self.arrays.get(name)
+            self.write_array(
+                name, capacity, dimensions, [] if array is None else array[: self.size]
+            )
+        active = np.zeros(capacity, dtype=bool)
+        active[: len(self.active)] = self.active
+        self.active = active
+
+    def select_rows(self, query, ids):
+        """Runs a query with an IN list of ids in bounded chunks."""
+        results = []
+        for i in range(0, len(ids), self.SQLITE_MAX_VARIABLES):
+            chunk = ids[i : i + self.SQLITE_MAX_VARIABLES]
+            results.extend(
+                self.connection.execute(
+                    query.format(",".join("?" * len(chunk))), chunk
+                ).fetchall()
+            )
+        return results
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def get(self, ids=None, where=None, include=None, offset=None, limit=None):
+        include = ["documents", "metadatas"] if include is None else include
+        # only read the columns that are returned or filtered on
+        columns = "row, id, {}, {}".format(
+            "document" if "documents" in include else "NULL",
+            "metadata" if "metadatas" in include or where else "NULL",
+        )
+        if ids is not None:
+            found = {
+                id: (row, document, metadata)
+                for row, id, document, metadata in self.select_rows(
+                    f"SELECT {columns} FROM rows WHERE id IN ({{}})", list(ids)
+                )
+            }
+            # Chroma returns ids in the order they were asked for
+            rows = [(found[id][0], id, *found[id][1:]) for id in ids if id in found]
+        elif where:
+            rows = self.connection.execute(
+                f"SELECT {columns} FROM rows ORDER BY row"
+            ).fetchall()
+        else:
+            # the page is cut in SQL, so paging through a store reads each row once
+            rows = self.connection.execute(
+                f"SELECT {columns} FROM rows ORDER BY row LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset or 0),
+            ).fetchall()
+            offset = limit = None
+        rows = [
+            (row, id, document, json.loads(metadata) if metadata else None)
+            for row, id, document, metadata in rows
+        ]
+        if where:
+            rows = [row for row in rows if matches_where(row[3], where)]
+        rows = rows[offset or 0 :]
+        if limit is not None:
+            rows = rows[:limit]
+        return self.build_result(rows, include)
+
+    def build_result(self, rows, include):
+        result = {
+            "ids": [id for _, id, _, _ in rows],
+            "documents": None,
+            "metadatas": None,
+            "embeddings": None,
+        }
+        if "documents" in include:
+            result["documents"] = [document for _, _, document, _ in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [metadata for _, _, _, metadata in rows]
+        if "embeddings" in include:
+            result["embeddings"] = self.get_embeddings([row for row, *_ in rows])
+        return result
+
+    def get_embeddings(self, rows):
+        """Returns the float32 embeddings of rows, dequantized if need be."""
+        if self.matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        if "exact" in self.arrays:
+            return np.asarray(self.arrays["exact"][rows], dtype=np.float32)
+        vectors = np.asarray(self.matrix[rows], dtype=np.float32)
+        if "scales" in self.arrays:
+            vectors *= self.arrays["scales"][rows][:, None]
+        return vectors
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        """Appends entries, ignoring ids that are already in the store."""
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        existing = {
+            id
+            for (id,) in self.select_rows(
+                "SELECT id FROM rows WHERE id IN ({})", list(ids)
+            )
+        }
+        entries = {}
+        for entry in zip(ids, embeddings, documents, metadatas):
+            if entry[0] not in existing:
+                entries.setdefault(entry[0], entry)
+        if not entries:
+            return
+        vectors = np.asarray([e[1] for e in entries.values()], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        quantized, scales = quantize(vectors, self.precision)
+        rows = {"embeddings": quantized, "scales": scales, "exact": vectors}
+        with self._lock:
+            start = self.size
+            self.allocate(start + len(vectors), vectors.shape[1])
+            for name, array in self.arrays.items():
+                array[start : start + len(vectors)] = rows[name]
+                array.flush()
+            with self.connection as connection:
+                connection.executemany(
+                    "INSERT INTO rows (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                    [
+                        (
+                            start + i,
+                            id,
+                            document,
+                            json.dumps(metadata) if metadata else None,
+                        )
+                        for i, (id, _, document, metadata) in enumerate(
+                            entries.values()
+                        )
+                    ],
+                )
+            self.size = start + len(vectors)
+            self.active[start : self.size] = True
+
+    def update(self, ids, metadatas):
+        with self.connection as connection:
+            connection.executemany(
+                "UPDATE rows SET metadata = ? WHERE id = ?",
+                [
+                    (json.dumps(metadata) if metadata else None, id)
+                    for id, metadata in zip(ids, metadatas)
+                ],
+            )
+
+    def delete(self, ids):
+        with self._lock:
+            rows = [
+                row
+                for (row,) in self.select_rows(
+                    "SELECT row FROM rows WHERE id IN ({})", list(ids)
+                )
+            ]
+            if not rows:
+                return
+            with self.connection as connection:
+                connection.executemany(
+                    "DELETE FROM rows WHERE row = ?", [(row,) for row in rows]
+                )
+            self.active[rows] = False
+            if self.size > self.INITIAL_CAPACITY and self.active.sum() < self.size / 2:
+                self.compact()
+
+    def compact(self):
+        """Moves the remaining rows to the front of the matrix."""
+        rows = np.flatnonzero(self.active[: self.size])
+        for array in self.arrays.values():
+            array[: len(rows)] = array[rows]
+            array.flush()
+        with self.connection as connection:
+            # two passes so the new row numbers never collide with old ones
+            connection.execute("UPDATE rows SET row = -row - 1")
+            connection.executemany(
+                "UPDATE rows SET row = ? WHERE row = ?",
+                [(new, -int(old) - 1) for new, old in enumerate(rows)],
+            )
+        self.size = len(rows)
+        self.active[:] = False
+        self.active[: self.size] = True
+
+    def candidate_rows(self, where):
+        if not where:
+            return np.flatnonzero(self.active[: self.size])
+        rows = [
+            row
+            for row, metadata in self.connection.execute(
+                "SELECT row, metadata FROM rows"
+            )
+            if matches_where(json.loads(metadata) if metadata else None, where)
+        ]
+        return np.asarray(sorted(rows), dtype=np.int64)
+
+    def score(self, queries, rows):
+        """
+        Returns:
+            The cosine similarity, or its estimate from the stored precision,
+            of every query to every candidate row.
+        """
+        # without deleted or filtered rows, the mapped matrix is used as is
+        # instead of copying rows out of it
+        every_row = len(rows) == self.size
+        if self.matrix.dtype == np.float32:
+            if every_row:
+                return queries @ self.matrix[: self.size].T
+            if len(rows) > self.size // 2:
+                return (queries @ self.matrix[: self.size].T)[:, rows]
+            return queries @ self.matrix[rows].T
+
+        # quantized rows are widened to float32 a cache sized block at a time
+        scales = self.arrays.get("scales")
+        scores = np.empty((len(queries), len(rows)), dtype=np.float32)
+        buffer = np.empty((self.SCAN_BLOCK_ROWS, self.matrix.shape[1]), np.float32)
+        for start in range(0, len(rows), self.SCAN_BLOCK_ROWS):
+            end = min(start + self.SCAN_BLOCK_ROWS, len(rows))
+            block = slice(start, end) if every_row else rows[start:end]
+            vectors = buffer[: end - start]
+            np.copyto(vectors, self.matrix[block], casting="unsafe")
+            scores[:, start:end] = queries @ vectors.T
+            if scales is not None:
+                scores[:, start:end] *= scales[block]
+        return scores
+
+    def top_k(self, scores, k):
+        """Returns the indices of the k highest scores, highest first."""
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def fetch_rows(self, rows):
+        """
+        Returns:
+            A list of (row, id, document, metadata) in the order of rows.
+        """
+        found = {
+            row: (row, id, document, json.loads(metadata) if metadata else None)
+            for row, id, document, metadata in self.select_rows(
+                "SELECT row, id, document, metadata FROM rows WHERE row IN ({})",
+                rows,
+            )
+        }
+        return [found[row] for row in rows]
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        include = (
+            ["documents", "metadatas", "distances"] if include is None else include
+        )
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries /= np.where(norms == 0, 1, norms)
+
+        rows = self.candidate_rows(where)
+        if len(rows):
+            scores = self.score(queries, rows)
+        else:
+            scores = np.zeros((len(queries), 0), dtype=np.float32)
+        k = min(n_results, len(rows))
+        candidates = min(k * self.RESCORE_CANDIDATES, len(rows)) if self.rescore else k
+        results = {
+            "ids": [],
+            "documents": [] if "documents" in include else None,
+            "metadatas": [] if "metadatas" in include else None,
+            "embeddings": [] if "embeddings" in include else None,
+            "distances": [] if "distances" in include else None,
+        }
+        for query, query_scores in zip(queries, scores):
+            top = self.top_k(query_scores, candidates)
+            top_scores = query_scores[top]
+            if self.rescore and len(top):
+                top_scores = self.arrays["exact"][rows[top]] @ query
+                order = self.top_k(top_scores, k)
+                top, top_scores = top[order], top_scores[order]
+            result = self.build_result(
+                self.fetch_rows([int(rows[i]) for i in top]), include
+            )
+            for key in ["ids", "documents", "metadatas", "embeddings"]:
+                if results[key] is not None:
+                    results[key].append(result[key])
+            if results["distances"] is not None:
+                # squared L2 between unit vectors, as Chroma reports it
+                results["distances"].append(
+                    [float(2.0 - 2.0 * score) for score in top_scores]
+                )
+        return results
+
+
+VECTOR_STORE_BACKENDS = {
+    ChromaVectorStore.name: ChromaVectorStore,
+    NumpyVectorStore.name: NumpyVectorStore,
+}
+
+
+def get_vector_store_backend_names():
+    return list(VECTOR_STORE_BACKENDS.keys())
+
+
+def get_vector_precision_names():
+    return list(PRECISIONS.keys())
@@ -0,0 +1,171 @@
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+import chromadb
+
+from gpt_nexus.nexus_base.vector_store import ChromaVectorStore, NumpyVectorStore
+
+
+class ReadWriteLock:
+    """
+    Allows many concurrent readers or a single writer. Writers waiting for
+    the lock block new readers so they are not starved.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read_lock(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class VectorStorePool:
+    """
+    Keeps one long-lived Chroma client per store directory and caches the
+    vector store of every collection, with a read/write lock per collection.
+    NumPy backed collections live in a "numpy" directory next to Chroma's.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._create_lock = threading.Lock()
+        self._collections = {}
+        self._collection_locks = {}
+
+    def get_client(self, path):
+        with self._lock:
+            client = self._clients.get(path)
+            if client is None:
+                client = chromadb.PersistentClient(path=path)
+                self._clients[path] = client
+            return client
+
+    def get_numpy_path(self, path, name):
+        return os.path.join(path, "numpy", name)
+
+    def get_collection(self, path, name, backend="chroma", **options):
+        """
+        Returns the vector store of a collection. Options are passed to the
+        NumPy backend, and a handle opened with other options is replaced.
+        """
+        key = (path, name, backend, tuple(sorted(options.items())))
+        with self._lock:
+            collection = self._collections.get(key)
+        if collection is not None:
+            return collection
+        # opening a NumPy store may convert its files, so only one at a time
+        with self._create_lock:
+            with self._lock:
+                collection = self._collections.get(key)
+            if collection is not None:
+                return collection
+            if backend == NumpyVectorStore.name:
+                collection = NumpyVectorStore(
+                    self.get_numpy_path(path, name), **options
+                )
+            elif backend == ChromaVectorStore.name:
+                collection = ChromaVectorStore(
+                    self.get_client(path).get_or_create_collection(name=name)
+                )
+            else:
+                raise ValueError(f"Unknown vector store backend '{backend}'.")
+            self.invalidate(path, name)
+            with self._lock:
+                self._collections[key] = collection
+            return collection
+
+    def get_lock(self, path, name):
+        key = (path, name)
+        with self._lock:
+            lock = self._collection_locks.get(key)
+            if lock is None:
+                lock = ReadWriteLock()
+                self._collection_locks[key] = lock
+            return lock
+
+    def invalidate(self, path, name):
+        with self._lock:
+            for key in [key for key in self._collections if key[:2] == (path, name)]:
+                del self._collections[key]
+
+    def list_collections(self, path):
+        """
+        Returns:
+            A dict of collection name to its backend.
+        """
+        collections = {
+            collection.name: ChromaVectorStore.name
+            for collection in self.get_client(path).list_collections()
+        }
+        numpy_path = os.path.join(path, "numpy")
+        if os.path.isdir(numpy_path):
+            for name in os.listdir(numpy_path):
+                collections.setdefault(name, NumpyVectorStore.name)
+        return collections
+
+    @contextmanager
+    def read(self, path, name, backend="chroma", **options):
+        """Yields the vector store while holding its read lock."""
+        with self.get_lock(path, name).read_lock():
+            yield self.get_collection(path, name, backend, **options)
+
+    @contextmanager
+    def write(self, path, name, backend="chroma", **options):
+        """Yields the vector store while holding its write lock."""
+        with self.get_lock(path, name).write_lock():
+            yield self.get_collection(path, name, backend, **options)
+
+    def delete_collection(self, path, name):
+        """Deletes the collection from every backend that has it."""
+        with self.get_lock(path, name).write_lock():
+            self.delete_backends(path, name)
+
+    def delete_backends(self, path, name):
+        self.invalidate(path, name)
+        try:
+            self.get_client(path).delete_collection(name)
+        except Exception:
+            pass  # not a Chroma collection
+        shutil.rmtree(self.get_numpy_path(path, name), ignore_errors=True)
+
+    def reset_collection(self, path, name, backend="chroma", **options):
+        """Deletes and recreates a collection, returning the new vector store."""
+        with self.get_lock(path, name).write_lock():
+            self.delete_backends(path, name)
+            return self.get_collection(path, name, backend, **options)
+
+
+# shared by the knowledge and memory managers
+vector_store_pool = VectorStorePool()
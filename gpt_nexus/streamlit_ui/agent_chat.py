@@ -88,11 +88,16 @@ def chat_page(username, win_height):
                                 chat.set_tracking_id(
                                     f"chat:thread{current_thread.thread_id}:{username}"
                                 )
-                                knowledge_rag = chat.apply_knowledge_RAG(
-                                    chat_agent.knowledge_store, user_input
+                                knowledge_rag = chat.apply_knowledge_stores_RAG(
+                                    chat_agent.knowledge_stores,
+                                    user_input,
+                                    model=getattr(chat_agent, "model", None),
                                 )
-                                memory_rag = chat.apply_memory_RAG(
-                                    chat_agent.memory_store, user_input, chat_agent
+                                memory_rag = "".join(
+                                    chat.apply_memory_RAG(
+                                        memory_store, user_input, chat_agent
+                                    )
+                                    for memory_store in chat_agent.memory_stores
                                 )
                                 content = user_input + knowledge_rag + memory_rag
                                 st.write_stream(
@@ -100,9 +105,9 @@ def chat_page(username, win_height):
                                         content, current_thread.id
                                     )
                                 )
-                            if chat_agent.memory_store != "None":
-                                chat.append_memory(
-                                    chat_agent.memory_store,
+                            for memory_store in chat_agent.memory_stores:
+                                chat.enqueue_memory(
+                                    memory_store,
                                     user_input,
                                     chat_agent.last_message,
                                     chat_agent,
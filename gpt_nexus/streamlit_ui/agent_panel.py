@@ -49,29 +49,44 @@ def agent_panel(chat):
         selected_actions = chat.get_actions(selected_action_names)
         chat_agent.actions = selected_actions
 
-    chat_agent.knowledge_store = "None"
+    # profiles may list the knowledge and memory stores an agent uses
+    profile = chat.get_profile(selected_profile)
+
+    def profile_stores(stores, names):
+        if isinstance(stores, str):
+            stores = [stores]
+        return [store for store in stores or [] if store in names]
+
+    chat_agent.knowledge_stores = []
     if chat_agent.supports_knowledge:
         knowledge_stores = chat.get_knowledge_store_names()
-        selected_knowledge_store = st.selectbox(
-            "Select a knowledge store:",
-            ["None"] + knowledge_stores,
-            key="knowledge_store",
+        chat_agent.knowledge_stores = st.multiselect(
+            "Select knowledge stores:",
+            knowledge_stores,
+            default=profile_stores(profile.knowledge, knowledge_stores),
+            key="knowledge_stores",
             # label_visibility="collapsed",
-            help="Choose the knowledge store to use.",
+            help="Choose the knowledge stores to use.",
         )
-        chat_agent.knowledge_store = selected_knowledge_store
+    # thought templates use a single store
+    chat_agent.knowledge_store = (
+        chat_agent.knowledge_stores[0] if chat_agent.knowledge_stores else "None"
+    )
 
-    chat_agent.memory_store = "None"
+    chat_agent.memory_stores = []
     if chat_agent.supports_memory:
         memory_stores = chat.get_memory_store_names()
-        selected_memory_store = st.selectbox(
-            "Select a memory store:",
-            ["None"] + memory_stores,
-            key="memory_store",
+        chat_agent.memory_stores = st.multiselect(
+            "Select memory stores:",
+            memory_stores,
+            default=profile_stores(profile.memory, memory_stores),
+            key="memory_stores",
             # label_visibility="collapsed",
-            help="Choose the memory store to use.",
+            help="Choose the memory stores to use.",
         )
-        chat_agent.memory_store = selected_memory_store
-    chat_agent.profile = chat.get_profile(selected_profile)
+    chat_agent.memory_store = (
+        chat_agent.memory_stores[0] if chat_agent.memory_stores else "None"
+    )
+    chat_agent.profile = profile
 
     return chat_agent
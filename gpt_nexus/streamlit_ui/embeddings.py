@@ -93,7 +93,7 @@ def view_embeddings(chat, item_store_name, store_type="memory"):
     embeddings = items["embeddings"]
     items = items["documents"]
 
-    if embeddings and items and len(embeddings) > 3:
+    if embeddings is not None and items and len(embeddings) > 3:
         # Applying PCA to reduce dimensions to 3
         pca = PCA(n_components=3)
         reduced_embeddings = pca.fit_transform(embeddings)
@@ -163,18 +163,25 @@ def view_embeddings(chat, item_store_name, store_type="memory"):
                 "Consider using the agent to compress if you have more than 10 items in a cluster."
             )
             if st.button("Compress"):
+                progress = st.progress(0.0)
+
+                def report_progress(done, total):
+                    progress.progress(
+                        done / total, text=f"Compressed {done} of {total} clusters"
+                    )
+
                 with st.spinner(
                     text=f"The agent is compressing {store_type}_{item_store_name}..."
                 ):
                     if store_type == "knowledge":
                         chat.compress_knowledge(
-                            item_store_name, grouped_items, chat_agent
+                            item_store_name, grouped_items, chat_agent, report_progress
                         )
                         st.success(f"{store_type} compressed successfully!")
                         st.rerun()
                     elif store_type == "memory":
                         chat.compress_memories(
-                            item_store_name, grouped_items, chat_agent
+                            item_store_name, grouped_items, chat_agent, report_progress
                         )
                         st.success(f"{store_type} compressed successfully!")
                         st.rerun()
@@ -2,6 +2,7 @@ import streamlit as st
 
 from gpt_nexus.streamlit_ui.cache import get_nexus
 from gpt_nexus.streamlit_ui.embeddings import view_embeddings
+from gpt_nexus.streamlit_ui.pagination import page_controls
 
 
 def add_document_to_store(chat, knowledge_store):
@@ -20,8 +21,27 @@ def add_document_to_store(chat, knowledge_store):
             # Assuming text files for simplicity, but you may need to handle different file types differently
             document_name = document_file.name
 
-            chat.load_document(knowledge_store, document_file)
-            st.success("Document uploaded and processed successfully!")
+            progress = st.empty()
+
+            def show_progress(chunks, segments):
+                progress.text(f"Embedded {chunks} chunks from {segments} sections...")
+
+            result = chat.load_document(knowledge_store, document_file, show_progress)
+            progress.empty()
+            if result and result.get("duplicate_of"):
+                st.info(
+                    f"Document has the same content as '{result['duplicate_of']}' "
+                    "and shares its chunks."
+                )
+            elif result and result["skipped"]:
+                st.info("Document is unchanged since it was last processed.")
+            else:
+                st.success("Document uploaded and processed successfully!")
+                if result and result["near_duplicates"]:
+                    st.info(
+                        f"Skipped {result['near_duplicates']} near-duplicate chunks, "
+                        f"saving {result['embeddings_saved']} embeddings."
+                    )
             chat.add_document_to_store(knowledge_store, document_name)
             st.success(
                 f"Document '{document_name}' added to Knowledge Store '{knowledge_store}'!"
@@ -84,8 +104,21 @@ def knowledge_page(username, win_height):
 
     with config_tabs[1]:
         st.subheader("Examine Documents in Knowledge Store")
-        df = chat.examine_documents(selected_store)
-        st.table(df)
+        offset, limit = page_controls(
+            chat.count_documents(selected_store), "examine_documents"
+        )
+        df = chat.examine_documents(selected_store, offset, limit)
+        st.dataframe(df, use_container_width=True, hide_index=True)
+
+        document_to_delete = st.selectbox(
+            "Select a document to delete:",
+            chat.get_knowledge_store_documents(selected_store),
+            key="delete_document",
+        )
+        if st.button("Delete Document", disabled=document_to_delete is None):
+            chat.delete_document_from_store(selected_store, document_to_delete)
+            st.success(f"Document '{document_to_delete}' and its chunks deleted!")
+            st.rerun()
 
     with config_tabs[2]:
         st.subheader("View Embeddings in Knowledge Store")
@@ -94,8 +127,17 @@ def knowledge_page(username, win_height):
     with config_tabs[3]:
         st.subheader("Query Knowledge Store")
         query = st.text_area("Enter a query to search for similar documents:")
+        mode = st.radio(
+            "Search Mode", chat.get_query_modes(), horizontal=True, key="query_mode"
+        )
+        documents = st.multiselect(
+            "Only search these documents:",
+            chat.get_knowledge_store_documents(selected_store),
+            key="query_documents",
+        )
+        where = {"document": {"$in": documents}} if documents else None
         if st.button("Search"):
-            docs = chat.query_documents(selected_store, query)
+            docs = chat.query_documents(selected_store, query, mode=mode, where=where)
             for doc in docs:
                 st.write(doc)
 
@@ -115,6 +157,91 @@ def knowledge_page(username, win_height):
         knowledge_store.overlap = st.number_input(
             "Overlap", min_value=0, value=knowledge_store.overlap
         )
+        backends = chat.get_embedding_backend_names()
+        knowledge_store.embedding_backend = st.selectbox(
+            "Embedding Backend",
+            backends,
+            index=backends.index(knowledge_store.embedding_backend),
+            disabled=chat.count_documents(knowledge_store.name) > 0,
+            help="Embeddings of different backends can not be compared, so it can "
+            "only be changed while the store is empty. Delete the documents, "
+            "change the backend and load them again.",
+        )
+        vector_backends = chat.get_vector_store_backend_names()
+        knowledge_store.vector_backend = st.selectbox(
+            "Vector Store",
+            vector_backends,
+            index=vector_backends.index(knowledge_store.vector_backend),
+            disabled=chat.count_documents(knowledge_store.name) > 0,
+            help="NumPy scans every chunk with one matrix product, which is faster "
+            "than Chroma for small and medium stores. Chunks are not moved "
+            "between backends, so it can only be changed while the store is empty.",
+        )
+        precisions = chat.get_vector_precision_names()
+        knowledge_store.vector_precision = st.selectbox(
+            "Vector Precision",
+            precisions,
+            index=precisions.index(knowledge_store.vector_precision),
+            disabled=knowledge_store.vector_backend != "numpy",
+            help="float16 and int8 embeddings take 2x and 4x less memory and disk "
+            "at a small cost in recall. int8 scans about as fast as float32, "
+            "float16 is slower to scan. Existing embeddings are converted the "
+            "next time the store is opened.",
+        )
+        knowledge_store.vector_rescore = st.checkbox(
+            "Re-score With Exact Embeddings",
+            value=knowledge_store.vector_rescore,
+            disabled=knowledge_store.vector_backend != "numpy"
+            or knowledge_store.vector_precision == "float32",
+            help="Keeps a float32 copy on disk to re-rank the best matches, "
+            "which recovers most of the recall lost to quantization.",
+        )
+        query_modes = chat.get_query_modes()
+        knowledge_store.query_mode = st.selectbox(
+            "Chat Query Mode",
+            query_modes,
+            index=query_modes.index(knowledge_store.query_mode),
+            help="How chat retrieves from the store. Keyword search needs no "
+            "embedding call and finds exact identifiers, hybrid combines it "
+            "with vector search.",
+        )
+        knowledge_store.near_duplicate_threshold = st.number_input(
+            "Near-Duplicate Threshold",
+            min_value=0.0,
+            max_value=1.0,
+            value=float(knowledge_store.near_duplicate_threshold),
+            step=0.05,
+            help="Skips chunks whose estimated word overlap with a chunk already "
+            "in the store is at least this high, such as repeated headers and "
+            "footers. Numbers count as words, so chunks that only differ in "
+            "figures or dates are kept. 0 disables the check.",
+        )
 
         if st.button("Save Configuration"):
             chat.update_knowledge_store(knowledge_store)
+
+        st.write(
+            "Re-chunk the store to apply the saved configuration to existing documents."
+        )
+        if st.button("Re-chunk Store"):
+            progress = st.progress(0.0)
+
+            def show_progress(done, total):
+                progress.progress(done / total, text=f"Re-chunked {done} of {total}")
+
+            with st.spinner("Re-chunking documents..."):
+                summary = chat.rechunk_knowledge_store(selected_store, show_progress)
+            st.success(
+                f"Re-chunked {summary['documents']} documents into {summary['chunks']} "
+                f"chunks ({summary['added']} embedded, {summary['removed']} removed)."
+            )
+            if summary["near_duplicates"]:
+                st.info(
+                    f"Skipped {summary['near_duplicates']} near-duplicate chunks, "
+                    f"saving {summary['embeddings_saved']} embeddings."
+                )
+            if summary["skipped"]:
+                st.warning(
+                    "These documents have no stored text and must be uploaded again: "
+                    + ", ".join(summary["skipped"])
+                )
@@ -3,6 +3,7 @@ import streamlit as st
 from gpt_nexus.nexus_base.nexus_models import MemoryType
 from gpt_nexus.streamlit_ui.cache import get_nexus
 from gpt_nexus.streamlit_ui.embeddings import get_agent, view_embeddings
+from gpt_nexus.streamlit_ui.pagination import page_controls
 
 
 def add_memory_to_store(chat, memory_store):
@@ -76,8 +77,11 @@ def memory_page(username, win_height):
 
     with config_tabs[1]:
         st.subheader("Examine Memories in Memory Store")
-        df = chat.examine_memories(selected_store)
-        st.table(df)
+        offset, limit = page_controls(
+            chat.count_memories(selected_store), "examine_memories"
+        )
+        df = chat.examine_memories(selected_store, offset, limit)
+        st.dataframe(df, use_container_width=True, hide_index=True)
 
     with config_tabs[2]:
         st.subheader("Memory Embeddings and Compression")
@@ -106,6 +110,44 @@ def memory_page(username, win_height):
             memory_types,
             index=memory_types.index(memory_store.memory_type),
         )
+        backends = chat.get_embedding_backend_names()
+        memory_store.embedding_backend = st.selectbox(
+            "Embedding Backend",
+            backends,
+            index=backends.index(memory_store.embedding_backend),
+            disabled=chat.count_memories(memory_store.name) > 0,
+            help="Embeddings of different backends can not be compared, so it can "
+            "only be changed while the store is empty.",
+        )
+        vector_backends = chat.get_vector_store_backend_names()
+        memory_store.vector_backend = st.selectbox(
+            "Vector Store",
+            vector_backends,
+            index=vector_backends.index(memory_store.vector_backend),
+            disabled=chat.count_memories(memory_store.name) > 0,
+            help="NumPy scans every memory with one matrix product, which is faster "
+            "than Chroma for small and medium stores. Memories are not moved "
+            "between backends, so it can only be changed while the store is empty.",
+        )
+        precisions = chat.get_vector_precision_names()
+        memory_store.vector_precision = st.selectbox(
+            "Vector Precision",
+            precisions,
+            index=precisions.index(memory_store.vector_precision),
+            disabled=memory_store.vector_backend != "numpy",
+            help="float16 and int8 embeddings take 2x and 4x less memory and disk "
+            "at a small cost in recall. int8 scans about as fast as float32, "
+            "float16 is slower to scan. Existing embeddings are converted the "
+            "next time the store is opened.",
+        )
+        memory_store.vector_rescore = st.checkbox(
+            "Re-score With Exact Embeddings",
+            value=memory_store.vector_rescore,
+            disabled=memory_store.vector_backend != "numpy"
+            or memory_store.vector_precision == "float32",
+            help="Keeps a float32 copy on disk to re-rank the best matches, "
+            "which recovers most of the recall lost to quantization.",
+        )
 
         memory_function = chat.get_memory_function(memory_store.memory_type)
         st.text_area("Memory Function:", memory_function.function_prompt, disabled=True)
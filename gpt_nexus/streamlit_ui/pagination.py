@@ -0,0 +1,25 @@
+import math
+
+import streamlit as st
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+def page_controls(total, key):
+    """
+    Shows page size and page number inputs for a collection of total items.
+
+    Returns:
+        A tuple of (offset, limit) for the selected page.
+    """
+    col1, col2, col3 = st.columns([1, 1, 2])
+    page_size = col1.selectbox("Page Size", PAGE_SIZES, key=f"{key}_page_size")
+    pages = max(1, math.ceil(total / page_size))
+    page = col2.number_input(
+        "Page", min_value=1, max_value=pages, value=1, key=f"{key}_page"
+    )
+    offset = (page - 1) * page_size
+    col3.caption(
+        f"Showing {min(offset + 1, total)}-{min(offset + page_size, total)} of {total}"
+    )
+    return offset, page_size
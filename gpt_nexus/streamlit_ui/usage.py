@@ -12,6 +12,67 @@ def usage_page(username, win_height):
         st.error("Invalid user")
         st.stop()
 
+    st.header("Embedding Cache")
+    cache_stats = chat.get_embedding_cache_stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Hits", cache_stats["hits"])
+    col2.metric("Misses", cache_stats["misses"])
+    col3.metric("Hit Rate", f"{cache_stats['hit_rate']:.0%}")
+    st.caption(
+        f"{cache_stats['entries']} of {cache_stats['max_entries']} cached embeddings"
+    )
+
+    st.header("Retrieval Cache")
+    rag_stats = chat.get_rag_cache_stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Hits", rag_stats["hits"])
+    col2.metric("Misses", rag_stats["misses"])
+    col3.metric("Hit Rate", f"{rag_stats['hit_rate']:.0%}")
+    st.caption(
+        f"{rag_stats['entries']} of {rag_stats['max_entries']} cached retrievals"
+    )
+
+    st.header("Retrieved Context")
+    context_stats = chat.get_context_stats()
+    if context_stats:
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    {
+                        "Source": source,
+                        "Retrievals": stats["retrievals"],
+                        "Chunks Packed": stats["chunks"],
+                        "Tokens": stats["tokens"],
+                        "Last Tokens": stats["last_tokens"],
+                    }
+                    for source, stats in context_stats.items()
+                ]
+            ),
+            hide_index=True,
+        )
+    else:
+        st.caption("No context retrieved yet")
+
+    st.header("Request Coalescing")
+    flight_stats = chat.get_single_flight_stats()
+    col1, col2 = st.columns(2)
+    col1.metric("Deduplicated Embeddings", flight_stats["embeddings"]["deduplicated"])
+    col2.metric(
+        "Deduplicated Semantic Responses",
+        flight_stats["semantic_responses"]["deduplicated"],
+    )
+
+    st.header("Memory Queue")
+    queue_stats = chat.get_memory_queue_stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Pending", queue_stats["depth"])
+    col2.metric("Oldest Pending", f"{queue_stats['oldest_lag']:.1f}s")
+    col3.metric("Last Lag", f"{queue_stats['last_lag']:.1f}s")
+    st.caption(
+        f"{queue_stats['processed']} appended, {queue_stats['failed']} failed, "
+        f"{queue_stats['retries']} retries, max lag {queue_stats['max_lag']:.1f}s"
+    )
+
     data = chat.get_tracking_usage()
     df = pd.DataFrame(data)
 
@@ -0,0 +1,19 @@
+from gpt_nexus.nexus_base.context_assembler import ContextAssembler
+
+
+def test_pack_respects_budget_and_cutoff():
+    assembler = ContextAssembler(budgets={"knowledge": 5}, min_similarity=0.5)
+    # count words so the test does not depend on a tokenizer
+    assembler.count_tokens = lambda text, model=None: len(text.split())
+    chunks = [
+        ("docs", "one two three", 0.7),
+        ("docs", "best match here four", 0.9),
+        ("docs", "irrelevant", 0.1),
+        ("notes", "short", 0.6),
+        ("notes", "keyword hit", None),
+    ]
+    selected = assembler.pack("knowledge", chunks)
+    assert selected == [("docs", "best match here four"), ("notes", "short")]
+    stats = assembler.get_stats()
+    assert stats["docs"]["last_tokens"] == 4
+    assert stats["notes"]["last_tokens"] == 1
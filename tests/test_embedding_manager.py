@@ -0,0 +1,138 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from gpt_nexus.nexus_base.embedding_cache import EmbeddingCache
+from gpt_nexus.nexus_base.embedding_manager import (
+    EmbeddingManager,
+    HashingEmbeddingBackend,
+    OpenAIEmbeddingBackend,
+)
+from gpt_nexus.nexus_base.utils import run_sync
+
+
+@pytest.fixture
+def em():
+    # Create an instance of EmbeddingManager that needs no network
+    return EmbeddingManager(backend="hashing")
+
+
+def test_hashing_embedding_is_deterministic(em):
+    first = em.get_embedding("The quick brown fox")
+    second = em.get_embedding("The quick brown fox")
+    assert first == second
+    assert len(first) == HashingEmbeddingBackend().dimensions
+
+
+def test_get_embeddings_keeps_input_order(em):
+    texts = ["alpha", None, "beta", "alpha"]
+    embeddings = em.get_embeddings(texts)
+    assert embeddings[1] is None
+    assert embeddings[0] == embeddings[3]
+    assert embeddings[0] != embeddings[2]
+
+
+def test_embedding_cache_counts_hits():
+    cache = EmbeddingCache(max_entries=10)
+    cache.invalidate(model="test-model")
+    assert cache.get_many("test-model", ["cached text"]) == [None]
+    cache.put_many("test-model", ["cached text"], [[0.5, 0.25]])
+    assert cache.get_many("test-model", ["cached  text"]) == [[0.5, 0.25]]
+    # a lookup that does not touch the cache is not counted
+    assert cache.get_many("test-model", ["cached text"], touch=False) == [[0.5, 0.25]]
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_batch_texts_packs_in_order_within_limits():
+    backend = OpenAIEmbeddingBackend()
+    # use the length based token estimate instead of tiktoken
+    backend.count_tokens = lambda text: len(text) // 4 + 1
+    backend.MAX_BATCH_ITEMS = 3
+    backend.MAX_BATCH_TOKENS = 10
+    texts = ["a" * 12, "b", "c", "d", "e" * 20, "f" * 40]
+    # estimates are 4, 1, 1, 1, 6 and 11 tokens
+    assert backend.batch_texts(texts) == [[0, 1, 2], [3, 4], [5]]
+
+
+class FlakyEmbeddings:
+    """Fails with a connection error a number of times before answering."""
+
+    def __init__(self, failures, error=None):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def create(self, input, model):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error or openai.APIConnectionError(
+                request=httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+            )
+        return SimpleNamespace(
+            data=[
+                SimpleNamespace(index=i, embedding=[float(len(text))])
+                for i, text in enumerate(input)
+            ],
+            usage=SimpleNamespace(total_tokens=len(input)),
+        )
+
+
+def test_single_batch_is_retried_with_backoff():
+    backend = OpenAIEmbeddingBackend(max_retries=2, backoff_base=0)
+    backend.count_tokens = lambda text: len(text) // 4 + 1
+    embeddings = FlakyEmbeddings(failures=2)
+    backend.client = SimpleNamespace(embeddings=embeddings)
+    assert backend.embed(["ab", "abc"]) == [[2.0], [3.0]]
+    assert embeddings.calls == 3
+    assert backend.tokens_used == 2
+
+    embeddings = FlakyEmbeddings(failures=3)
+    backend.client = SimpleNamespace(embeddings=embeddings)
+    with pytest.raises(openai.APIConnectionError):
+        backend.embed(["ab"])
+    assert embeddings.calls == 3
+
+    # errors that are not transient are raised without retrying
+    embeddings = FlakyEmbeddings(failures=1, error=ValueError("bad input"))
+    backend.client = SimpleNamespace(embeddings=embeddings)
+    with pytest.raises(ValueError):
+        backend.embed(["ab"])
+    assert embeddings.calls == 1
+
+
+class SlowEmbeddings:
+    """Answers asynchronously and records the most requests in flight."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, input, model):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        return FlakyEmbeddings(failures=0).create(input, model)
+
+
+def test_concurrency_limit_is_shared_across_calls():
+    backend = OpenAIEmbeddingBackend(max_concurrency=2)
+    backend.count_tokens = lambda text: len(text) // 4 + 1
+    backend.MAX_BATCH_ITEMS = 1
+    embeddings = SlowEmbeddings()
+    client = SimpleNamespace(embeddings=embeddings)
+    backend.get_async_client = lambda: client
+
+    async def embed_together():
+        return await asyncio.gather(
+            backend.aembed(["a", "bb", "ccc"]), backend.aembed(["dddd", "eeeee"])
+        )
+
+    first, second = run_sync(embed_together())
+    assert first == [[1.0], [2.0], [3.0]] and second == [[4.0], [5.0]]
+    assert embeddings.max_in_flight == 2
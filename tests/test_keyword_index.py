@@ -0,0 +1,15 @@
+from gpt_nexus.nexus_base.keyword_index import KeywordIndex, reciprocal_rank_fusion
+
+
+def test_keyword_index_matches_identifiers(tmp_path):
+    index = KeywordIndex(str(tmp_path / "fts.db"))
+    index.add("store", ["a", "b"], ["order ID-0042 shipped", "order ID-0043 lost"])
+    index.add("store", ["a"], ["order ID-0042 shipped"])
+    assert index.count("store") == 2
+    assert [id for id, _, _ in index.search("store", "ID-0042")] == ["a"]
+    index.delete("store", ["a"])
+    assert index.search("store", "ID-0042") == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "c"]]) == ["b", "c", "a"]
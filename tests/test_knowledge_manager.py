@@ -0,0 +1,207 @@
+import json
+import os
+
+import pytest
+
+from gpt_nexus.nexus_base.ingest import LocalFile
+from gpt_nexus.nexus_base.knowledge_manager import KnowledgeManager
+from gpt_nexus.nexus_base.nexus_models import (
+    Document,
+    IngestionRecord,
+    KnowledgeStore,
+    db,
+)
+
+
+@pytest.fixture(scope="module")
+def km(tmp_path_factory):
+    # the databases and collections are created relative to the working directory
+    path = tmp_path_factory.mktemp("knowledge")
+    cwd = os.getcwd()
+    os.chdir(path)
+    db.init(str(path / "nexus.db"))
+    db.create_tables([KnowledgeStore, Document, IngestionRecord], safe=True)
+    yield KnowledgeManager()
+    db.close()
+    # later tests use the default database again
+    db.init("nexus.db")
+    os.chdir(cwd)
+
+
+def create_store(name, **fields):
+    return KnowledgeStore.create(name=name, embedding_backend="hashing", **fields)
+
+
+def upload(text, name="notes.txt"):
+    return LocalFile(text.encode("utf-8"), name, "text/plain")
+
+
+def test_embedding_backend_only_changes_while_empty(km):
+    store = create_store("switch")
+    km.load_document(store, upload("rockets burn fuel to reach orbit"))
+    store.embedding_backend = "openai"
+    with pytest.raises(ValueError):
+        km.check_embedding_backend(store)
+    store.embedding_backend = "hashing"
+    assert km.search_documents("switch", "rockets")[0][1].startswith("rockets")
+
+    km.delete_document(store, "notes.txt")
+    store.embedding_backend = "openai"
+    km.check_embedding_backend(store)
+    store.save()
+    assert km.get_embedding_manager(store).backend.name == "openai"
+
+
+def test_vector_backend_only_changes_while_empty(km):
+    store = create_store("vectors")
+    km.load_document(store, upload("rockets burn fuel to reach orbit"))
+    store.vector_backend = "numpy"
+    with pytest.raises(ValueError):
+        km.check_vector_backend(store)
+    store.vector_backend = "chroma"
+
+    km.delete_document(store, "notes.txt")
+    store.vector_backend = "numpy"
+    km.check_vector_backend(store)
+    store.save()
+    km.load_document(store, upload("rockets burn fuel to reach orbit"))
+    assert km.get_vector_config(store)[0] == "numpy"
+    assert km.search_documents("vectors", "rockets")[0][1].startswith("rockets")
+
+
+def test_ingest_embeds_batches_of_a_window_concurrently(km, monkeypatch):
+    monkeypatch.setattr(km, "INGEST_BATCH_SIZE", 4)
+    store = create_store("batches")
+    embedding_manager = km.get_embedding_manager(store)
+    aget_embeddings = embedding_manager.aget_embeddings
+    calls = []
+
+    async def counted(texts):
+        calls.append(len(texts))
+        return await aget_embeddings(texts)
+
+    monkeypatch.setattr(embedding_manager, "aget_embeddings", counted)
+    # the repeated chunk is added by the first batch of the window
+    chunks = [f"chunk number {i}" for i in range(10)] + ["chunk number 0"]
+    chunk_ids, added = km.ingest_chunks(store, chunks)
+    assert (len(chunk_ids), added) == (10, 10)
+    assert calls == [4, 4, 2]
+    assert km.count_documents("batches") == 10
+
+
+def test_reload_is_idempotent_and_shares_renamed_copies(km):
+    store = create_store("reload")
+    text = "\n".join(f"line {i} about orbital mechanics" for i in range(40))
+    first = km.load_document(store, upload(text, "a.txt"))
+    assert not first["skipped"] and first["added"] == first["chunks"] > 0
+    assert km.load_document(store, upload(text, "a.txt"))["skipped"]
+
+    copy = km.load_document(store, upload(text, "b.txt"))
+    assert copy["skipped"] and copy["duplicate_of"] == "a.txt"
+    record = IngestionRecord.get(
+        (IngestionRecord.store == store) & (IngestionRecord.document_name == "b.txt")
+    )
+    assert len(json.loads(record.chunk_ids)) == first["chunks"]
+    assert Document.get(store=store, name="b.txt").text is not None
+
+    # the chunks stay as long as one of the documents uses them
+    assert km.delete_document(store, "a.txt") == 0
+    assert km.count_documents("reload") == first["chunks"]
+    assert km.delete_document(store, "b.txt") == first["chunks"]
+    assert km.count_documents("reload") == 0
+
+
+def test_failed_ingest_removes_the_chunks_it_added(km, monkeypatch):
+    monkeypatch.setattr(km, "INGEST_BATCH_SIZE", 2)
+    monkeypatch.setattr(km, "INGEST_CONCURRENT_BATCHES", 1)
+    store = create_store("failed", chunk_size=20, overlap=0)
+    embed_batches = km.embed_batches
+    calls = []
+
+    def fail_second_window(knowledge_store, batches):
+        calls.append(len(batches))
+        if len(calls) == 2:
+            raise RuntimeError("embedding provider is down")
+        return embed_batches(knowledge_store, batches)
+
+    monkeypatch.setattr(km, "embed_batches", fail_second_window)
+    text = "\n".join(f"fact {i} about rockets" for i in range(6))
+    with pytest.raises(RuntimeError):
+        km.load_document(store, upload(text))
+    assert km.count_documents("failed") == 0
+    assert km.keyword_index.count("failed") == 0
+    assert not Document.select().where(Document.store == store).exists()
+
+    monkeypatch.setattr(km, "embed_batches", embed_batches)
+    assert km.load_document(store, upload(text))["added"] == 6
+    assert km.count_documents("failed") == 6
+
+
+def test_shared_chunks_keep_their_document(km):
+    store = create_store("shared", chunk_size=40, overlap=0)
+    shared = "a paragraph both documents contain"
+    km.load_document(store, upload(f"notes only in the first one\n{shared}", "a.txt"))
+    km.load_document(store, upload(f"{shared}\nnotes only in the second one", "b.txt"))
+    where = {"document": "a.txt"}
+    found = km.search_documents("shared", shared, 1, "vector", where)
+    assert found[0][1] == shared and found[0][3]["document"] == "a.txt"
+
+    # once its owner is deleted, the chunk moves to the document that still has it
+    km.delete_document(store, "a.txt")
+    km.rechunk_store(store)
+    found = km.search_documents("shared", shared, 1, "vector", {"document": "b.txt"})
+    assert found[0][1] == shared and found[0][3]["ordinal"] == 0
+
+
+class StatementAgent:
+    def get_semantic_response(self, prompt, text):
+        return json.dumps({"statements": ["rockets burn fuel", "orbits are fast"]})
+
+
+def test_rechunk_does_not_restore_compressed_documents(km):
+    store = create_store("compressed", chunk_size=30, overlap=0)
+    km.load_document(store, upload("rockets burn fuel\nto reach a fast orbit", "a.txt"))
+    km.load_document(store, upload("orbits are fast\nand rockets are loud", "b.txt"))
+    km.compress_knowledge(store, {0: ["a", "b"]}, StatementAgent())
+    assert km.count_documents("compressed") == 2
+
+    summary = km.rechunk_store(store)
+    assert summary["skipped"] == ["a.txt", "b.txt"] and summary["added"] == 0
+    assert km.count_documents("compressed") == 2
+
+
+def test_stitch_chunks_merges_overlapping_and_adjacent_chunks(km):
+    def chunk(text, start, similarity, document_id=1):
+        metadata = {"document_id": document_id, "start": start}
+        metadata["end"] = start + len(text)
+        return ("store", text, similarity, metadata)
+
+    chunks = [
+        chunk("world, again", 6, 0.9),
+        chunk("hello world", 0, 0.8),
+        chunk("elsewhere", 100, 0.7),
+        ("store", "no position", 0.6, None),
+        chunk("hello", 0, 0.5, document_id=2),
+        chunk(" there", 5, 0.4, document_id=2),
+    ]
+    assert km.stitch_chunks(chunks) == [
+        ("store", "hello world, again", 0.9),
+        ("store", "elsewhere", 0.7),
+        ("store", "no position", 0.6),
+        ("store", "hello there", 0.5),
+    ]
+
+
+@pytest.mark.parametrize("mode", KnowledgeManager.QUERY_MODES)
+def test_where_filters_every_query_mode(km, mode):
+    store = create_store(f"where-{mode}")
+    km.load_document(store, upload("order ID-0042 shipped to the moon", "a.txt"))
+    km.load_document(store, upload("order ID-0042 lost on the way", "b.txt"))
+    found = km.search_documents(
+        store.name, "order ID-0042", 5, mode, {"document": "b.txt"}
+    )
+    assert [metadata["document"] for *_, metadata in found] == ["b.txt"]
+    found = km.search_documents(
+        store.name, "order ID-0042", 5, mode, {"document": {"$in": ["a.txt", "b.txt"]}}
+    )
+    assert len(found) == 2
@@ -0,0 +1,48 @@
+from gpt_nexus.nexus_base.context_variables import tracking_id_context
+from gpt_nexus.nexus_base.memory_queue import MemoryWriteQueue
+
+
+def test_memory_write_queue_retries_in_enqueued_context():
+    calls = []
+
+    def write(memory):
+        calls.append((memory, tracking_id_context.get()))
+        # the first attempt fails with a transient error and is retried
+        if len(calls) == 1:
+            raise TimeoutError("provider timed out")
+        return True
+
+    queue = MemoryWriteQueue(
+        write, lambda error: isinstance(error, TimeoutError), backoff_base=0.01
+    )
+    tracking_id_context.set("thread-1")
+    assert queue.enqueue("memory")
+    tracking_id_context.set("Not set")
+    assert queue.flush(timeout=5)
+    assert calls == [("memory", "thread-1"), ("memory", "thread-1")]
+    stats = queue.get_stats()
+    assert stats["depth"] == 0
+    assert (stats["processed"], stats["failed"], stats["retries"]) == (1, 0, 1)
+    assert queue.shutdown(timeout=5)
+    assert not queue.enqueue("memory")
+
+
+def test_memory_write_queue_does_not_retry_permanent_failures():
+    calls = []
+
+    def write(result):
+        calls.append(result)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    queue = MemoryWriteQueue(
+        write, lambda error: isinstance(error, TimeoutError), backoff_base=0.01
+    )
+    # a failed append and an error that retrying would not fix
+    queue.enqueue(False)
+    queue.enqueue(ValueError("response is not JSON"))
+    assert queue.flush(timeout=5)
+    assert len(calls) == 2
+    stats = queue.get_stats()
+    assert (stats["processed"], stats["failed"], stats["retries"]) == (0, 2, 0)
@@ -0,0 +1,24 @@
+from gpt_nexus.nexus_base.near_duplicates import MinHashIndex
+
+FOOTER = (
+    "Copyright 2024 Example Corp. All rights reserved. This document is "
+    "confidential and may not be distributed without written permission.{}"
+)
+TABLE = "Quarter revenue by region: north {} million, south 85 million, east 97 million"
+
+
+def test_minhash_index_skips_near_duplicates():
+    index = MinHashIndex(threshold=0.8)
+    assert index.add_if_unique("a", FOOTER.format("")) is None
+    assert index.add_if_unique("b", FOOTER.format(" Thanks.")) == "a"
+    assert index.add_if_unique("c", "rockets burn fuel to reach orbit") is None
+    assert len(index) == 2
+    index.remove(["a"])
+    assert index.add_if_unique("b", FOOTER.format(" Thanks.")) is None
+
+
+def test_minhash_index_keeps_chunks_that_differ_in_numbers():
+    index = MinHashIndex(threshold=0.9)
+    assert index.add_if_unique("q1", TABLE.format(120)) is None
+    assert index.add_if_unique("q2", TABLE.format(135)) is None
+    assert index.add_if_unique("q3", TABLE.format(120)) == "q1"
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from gpt_nexus.nexus_base.single_flight import SingleFlight
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        release.wait()
+        return value * 2
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("key", slow, 21)))
+        for _ in range(4)
+    ]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    wait_for(lambda: flight.get_stats()["deduplicated"] == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [21]
+    assert results == [42] * 4
+    # the key is released once the call finishes
+    assert flight.do("key", lambda: "again") == "again"
+    assert flight.get_stats() == {"calls": 2, "deduplicated": 3}
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait()
+        raise ValueError("failed")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    threads[0].start()
+    started.wait()
+    threads[1].start()
+    wait_for(lambda: flight.get_stats()["deduplicated"] == 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
+    with pytest.raises(ValueError):
+        flight.do("key", failing)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from gpt_nexus.nexus_base.vector_store import NumpyVectorStore, matches_where
+
+
+def test_numpy_vector_store_queries_like_chroma(tmp_path):
+    store = NumpyVectorStore(str(tmp_path / "store"))
+    store.add(
+        ids=["a", "b", "c"],
+        embeddings=[[1.0, 0.0], [0.0, 2.0], [1.0, 1.0]],
+        documents=["east", "north", "north east"],
+        metadatas=[{"document": "x.txt"}, {"document": "y.txt"}, None],
+    )
+    store.add(ids=["a"], embeddings=[[0.0, 1.0]], documents=["ignored"])
+    assert store.count() == 3
+
+    found = store.query(query_embeddings=[[1.0, 0.0]], n_results=2)
+    assert found["ids"] == [["a", "c"]]
+    assert np.allclose(found["distances"][0], [0.0, 2.0 - np.sqrt(2.0)])
+    found = store.query(
+        query_embeddings=[[1.0, 0.0]],
+        n_results=2,
+        where={"document": {"$in": ["y.txt"]}},
+    )
+    assert found["ids"] == [["b"]]
+
+    store.delete(["a"])
+    store.update(ids=["c"], metadatas=[{"document": "z.txt"}])
+    reopened = NumpyVectorStore(str(tmp_path / "store"))
+    assert reopened.get(include=["metadatas"]) == {
+        "ids": ["b", "c"],
+        "documents": None,
+        "metadatas": [{"document": "y.txt"}, {"document": "z.txt"}],
+        "embeddings": None,
+    }
+    assert reopened.query(query_embeddings=[[1.0, 0.0]], n_results=1)["ids"] == [["c"]]
+
+
+def test_numpy_vector_store_converts_precision(tmp_path):
+    generator = np.random.default_rng(0)
+    vectors = generator.standard_normal((200, 32)).astype(np.float32)
+    ids = [str(i) for i in range(len(vectors))]
+    NumpyVectorStore(str(tmp_path / "store")).add(ids, vectors)
+
+    store = NumpyVectorStore(str(tmp_path / "store"), "int8", rescore=True)
+    assert store.matrix.dtype == np.int8
+    found = store.query(query_embeddings=vectors[:3], n_results=1)
+    assert found["ids"] == [["0"], ["1"], ["2"]]
+    assert np.allclose(found["distances"], 0.0, atol=1e-5)
+
+    store = NumpyVectorStore(str(tmp_path / "store"), "float16")
+    assert sorted(store.arrays) == ["embeddings"]
+    embeddings = store.get(ids=["5"], include=["embeddings"])["embeddings"]
+    assert np.allclose(
+        embeddings[0], vectors[5] / np.linalg.norm(vectors[5]), atol=1e-2
+    )
+
+
+def test_matches_where_supports_chroma_operators():
+    metadata = {"document": "a.txt", "ordinal": 3}
+    assert matches_where(metadata, None)
+    assert matches_where(metadata, {"document": "a.txt"})
+    assert not matches_where(metadata, {"document": {"$ne": "a.txt"}})
+    assert matches_where(metadata, {"document": {"$in": ["a.txt", "b.txt"]}})
+    assert matches_where(metadata, {"ordinal": {"$gte": 3, "$lt": 4}})
+    assert not matches_where(metadata, {"missing": {"$gt": 0}})
+    assert matches_where(
+        metadata, {"$or": [{"document": "b.txt"}, {"ordinal": {"$lte": 3}}]}
+    )
+    assert not matches_where(
+        metadata, {"$and": [{"document": "a.txt"}, {"ordinal": {"$nin": [3]}}]}
+    )
+    with pytest.raises(ValueError):
+        matches_where(metadata, {"ordinal": {"$like": 3}})
+
+
+def test_numpy_vector_store_pages_in_order(tmp_path):
+    store = NumpyVectorStore(str(tmp_path / "store"))
+    ids = [str(i) for i in range(6)]
+    store.add(
+        ids=ids,
+        embeddings=[[1.0, float(i)] for i in range(6)],
+        documents=[f"doc {i}" for i in range(6)],
+        metadatas=[{"even": i % 2 == 0} for i in range(6)],
+    )
+    store.delete(["1"])
+    page = store.get(include=["documents"], offset=1, limit=2)
+    assert page["ids"] == ["2", "3"]
+    assert page["documents"] == ["doc 2", "doc 3"]
+    assert page["metadatas"] is None
+    assert store.get(include=[], offset=3)["ids"] == ["4", "5"]
+    assert store.get(where={"even": True}, include=[], offset=1)["ids"] == ["2", "4"]
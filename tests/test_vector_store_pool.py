@@ -0,0 +1,49 @@
+import threading
+import time
+
+from gpt_nexus.nexus_base.vector_store_pool import ReadWriteLock, VectorStorePool
+
+
+def test_read_write_lock_prefers_waiting_writers():
+    lock = ReadWriteLock()
+    order = []
+    with lock.read_lock():
+        # readers share the lock
+        with lock.read_lock():
+            order.append("readers")
+
+        def write():
+            with lock.write_lock():
+                order.append("writer")
+
+        def read():
+            with lock.read_lock():
+                order.append("reader")
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        while not lock._waiting_writers:
+            time.sleep(0.001)
+        # a reader arriving after a waiting writer is queued behind it
+        reader = threading.Thread(target=read)
+        reader.start()
+        time.sleep(0.05)
+        assert order == ["readers"]
+    writer.join()
+    reader.join()
+    assert order == ["readers", "writer", "reader"]
+
+
+def test_pool_shares_vector_store_handles(tmp_path):
+    pool = VectorStorePool()
+    path = str(tmp_path)
+    with pool.write(path, "store", "numpy") as store:
+        store.add(ids=["a"], embeddings=[[1.0, 0.0]], documents=["east"])
+    with pool.read(path, "store", "numpy") as first:
+        with pool.read(path, "store", "numpy") as second:
+            assert first is second
+            assert second.count() == 1
+    # a handle opened with other options replaces the cached one
+    with pool.read(path, "store", "numpy", precision="int8") as quantized:
+        assert quantized is not first
+        assert quantized.count() == 1